@@ -13,15 +13,39 @@
 #  DB 0x0a   ; a hex byte
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
+#
+#  .include "lib/print.inc"   ; paste in another file, once
+#
+#  .macro PRINT addr, len     ; define a macro with two parameters
+#  LDI R0,\addr
+#  LDI R1,\len
+#  Skip\@:                    ; \@ is unique per expansion
+#  .endm
+#
+#  PRINT Hello,14             ; expand it
+#
+# Instructions outside the LS-8 spec are grouped into optional ISA
+# extensions (see EXTENSIONS). Only the spec is accepted unless -x or an
+# .ext directive turns extensions on; --strict holds to the spec even then.
+#
+#  .ext bulk                  ; MEMCPY, MEMSET and PRS from here on
+#
+# Debug info (source lines and symbols) is written to a .dbg file next to
+# the output file unless --no-debug is given.
 
+import hashlib
 import sys
+import os
 import re
+import json
+from collections import namedtuple
 
 # Opcodes
 OPCODES = {
     "ADD":  {"type": 2, "code": "10100000"},
     "AND":  {"type": 2, "code": "10101000"},
     "CALL": {"type": 1, "code": "01010000"},
+    "CAS":  {"type": 2, "code": "10001000", "ext": "atomic"},
     "CMP":  {"type": 2, "code": "10100111"},
     "DEC":  {"type": 1, "code": "01100110"},
     "DIV":  {"type": 2, "code": "10100011"},
@@ -38,6 +62,8 @@ OPCODES = {
     "JNE":  {"type": 1, "code": "01010110"},
     "LD":   {"type": 2, "code": "10000011"},
     "LDI":  {"type": 8, "code": "10000010"},
+    "MEMCPY": {"type": 3, "code": "11000001", "ext": "bulk"},
+    "MEMSET": {"type": 3, "code": "11000010", "ext": "bulk"},
     "MOD":  {"type": 2, "code": "10100100"},
     "MUL":  {"type": 2, "code": "10100010"},
     "NOP":  {"type": 0, "code": "00000000"},
@@ -46,29 +72,95 @@ OPCODES = {
     "POP":  {"type": 1, "code": "01000110"},
     "PRA":  {"type": 1, "code": "01001000"},
     "PRN":  {"type": 1, "code": "01000111"},
+    "PRS":  {"type": 2, "code": "10001010", "ext": "bulk"},
     "PUSH": {"type": 1, "code": "01000101"},
     "RET":  {"type": 0, "code": "00010001"},
     "SHL":  {"type": 2, "code": "10101100"},
     "SHR":  {"type": 2, "code": "10101101"},
     "ST":   {"type": 2, "code": "10000100"},
     "SUB":  {"type": 2, "code": "10100001"},
+    "TAS":  {"type": 2, "code": "10001001", "ext": "atomic"},
     "XOR":  {"type": 2, "code": "10101011"},
 }
 
+# ISA extensions: instructions that aren't in the LS-8 spec
+#
+#  atomic  CAS, TAS for multi-core machines
+#  bulk    MEMCPY, MEMSET and PRS, block memory operations
+EXTENSIONS = sorted({info["ext"] for info in OPCODES.values()
+                     if "ext" in info})
+
 # Regex for matching lines
-# Capturing groups: label, opcode, operandA, operandB
-REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+# Capturing groups: label, opcode, operandA, operandB, operandC
+REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+)" \
+        r"(?:\s*,\s*(\w+))?)?)?)?"
 
 # Regex for capturing DS and DB data
 REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
 REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
 
+# Regexes for preprocessor directives and macro invocations
+REGEX_INCLUDE = r"\.include\s+\"?([^\"]+?)\"?$"  # insensitive
+REGEX_MACRO = r"\.macro\s+(\w+)\s*(.*)"  # insensitive
+REGEX_ENDM = r"\.endm$"  # insensitive
+REGEX_INVOKE = r"(?:(\w+):)?\s*(\w+)(?:\s+(.*))?$"
+REGEX_MACRO_ARG = r"\\(\w+|@)"
+REGEX_EXT = r"\.ext\b\s*(.*)$"  # insensitive
+
+# Deepest macro expansion allowed, so recursive macros fail cleanly
+MAX_MACRO_DEPTH = 64
+
+# Preprocessed include units are cached here by content hash. Bump
+# UNIT_FORMAT whenever their layout changes.
+UNIT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "__pycache__", "asm-units")
+UNIT_FORMAT = 1
+
+# The same cache in memory, for builds that assemble many files per process
+unit_cache = {}
+
+# A line of preprocessed source. file and line are where the text was
+# written; macro is a tuple of (macro name, "file:line" of the invocation)
+# pairs, innermost first, if the line came from a macro expansion.
+SourceLine = namedtuple("SourceLine", "text file line macro")
+
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [--strict | -x ext[,ext...]] [--no-debug] [inputfile]
+                  [outputfile]
+
+    Returns the input and output file names, the set of ISA extensions to
+    accept, whether to reject .ext directives too, and whether to write
+    debug info.
     """
 
+    argv = list(argv)
+    extensions = set()
+    strict = False
+    debug = True
+
+    if "--no-debug" in argv:
+        argv.remove("--no-debug")
+        debug = False
+
+    if "--strict" in argv:
+        argv.remove("--strict")
+        strict = True
+
+    if "-x" in argv and not strict:
+        i = argv.index("-x")
+        names = argv[i + 1].split(",") if i + 1 < len(argv) else []
+        del argv[i:i + 2]
+
+        unknown = [n for n in names if n not in EXTENSIONS]
+        if not names or unknown:
+            print(f"-x takes a list of extensions: "
+                  f"{', '.join(EXTENSIONS)}", file=sys.stderr)
+            sys.exit(1)
+
+        extensions = set(names)
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -82,10 +174,11 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [--strict | -x ext[,ext...]] [--no-debug] "
+              "[infile.asm] [outfile.ls8]", file=sys.stderr)
         sys.exit(1)
 
-    return inputfile, outputfile
+    return inputfile, outputfile, extensions, strict, debug
 
 
 def open_files(inputfile, outputfile):
@@ -127,18 +220,295 @@ def p8(v):
     return "{:08b}".format(v)
 
 
-def pass1(inputfile, sym, code):
+def location(source_line):
+    """
+    "call.asm:12", or for a macro expansion
+    "lib.inc:3 (in PRINT expanded at call.asm:12)".
+    """
+
+    where = f"{source_line.file}:{source_line.line}"
+
+    for name, at in source_line.macro:
+        where += f" (in {name} expanded at {at})"
+
+    return where
+
+
+def scan_unit(text, filename):
+    """
+    Split a source file into a list of items, with comments and blank lines
+    stripped:
+
+      ["line", line number, text]
+      ["include", line number, file name]
+      ["macro", line number, NAME, [parameters], [[line number, text], ...]]
+
+    Nothing here depends on where the file is included from, so the result
+    can be cached by the file's contents.
+    """
+
+    items = []
+    macro = None
+
+    for line_num, line in enumerate(text.splitlines(), 1):
+        # Strip comments
+        comment_index = line.find(';')
+        if comment_index != -1:
+            line = line[:comment_index]
+
+        # Normalize
+        line = line.strip()
+
+        # Ignore blank lines
+        if line == '':
+            continue
+
+        m = re.match(REGEX_MACRO, line, re.IGNORECASE)
+
+        if m is not None:
+            if macro is not None:
+                print(f"{filename}:{line_num}: .macro inside .macro",
+                      file=sys.stderr)
+                sys.exit(1)
+
+            name = m.group(1).upper()
+            params = [p.strip() for p in m.group(2).split(",")] \
+                if m.group(2).strip() else []
+
+            for p in params:
+                if re.fullmatch(r"\w+", p) is None:
+                    print(f"{filename}:{line_num}: bad macro parameter "
+                          f"'{p}'", file=sys.stderr)
+                    sys.exit(1)
+
+            if len({p.upper() for p in params}) != len(params):
+                print(f"{filename}:{line_num}: duplicate macro parameter",
+                      file=sys.stderr)
+                sys.exit(1)
+
+            macro = ["macro", line_num, name, params, []]
+
+        elif re.match(REGEX_ENDM, line, re.IGNORECASE):
+            if macro is None:
+                print(f"{filename}:{line_num}: .endm without .macro",
+                      file=sys.stderr)
+                sys.exit(1)
+
+            items.append(macro)
+            macro = None
+
+        elif macro is not None:
+            macro[4].append([line_num, line])
+
+        else:
+            m = re.match(REGEX_INCLUDE, line, re.IGNORECASE)
+
+            if m is not None:
+                items.append(["include", line_num, m.group(1)])
+            else:
+                items.append(["line", line_num, line])
+
+    if macro is not None:
+        print(f"{filename}:{macro[1]}: .macro {macro[2]} without .endm",
+              file=sys.stderr)
+        sys.exit(1)
+
+    return items
+
+
+def load_unit(filename):
+    """
+    The scanned items of an included file, from the cache if this exact
+    content has been scanned before.
+    """
+
+    with open(filename) as f:
+        text = f.read()
+
+    key = hashlib.sha256(f"{UNIT_FORMAT}:{text}".encode()).hexdigest()
+
+    if key in unit_cache:
+        return unit_cache[key]
+
+    cache_file = os.path.join(UNIT_CACHE_DIR, key + ".json")
+
+    try:
+        with open(cache_file) as f:
+            items = json.load(f)
+
+    except (OSError, ValueError):
+        items = scan_unit(text, filename)
+
+        # The cache is only an optimization, so don't fail if it can't be
+        # written
+        try:
+            os.makedirs(UNIT_CACHE_DIR, exist_ok=True)
+            tmp = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(items, f, separators=(",", ":"))
+            os.replace(tmp, cache_file)
+        except OSError:
+            pass
+
+    unit_cache[key] = items
+
+    return items
+
+
+def preprocess(inputfile):
+    """
+    Preprocess
+
+    * Strip comments and blank lines
+    * Paste in .include files, relative to the including file. Each file is
+      only included once, however many times it's asked for.
+    * Record .macro definitions and expand macro invocations, replacing
+      \param with arguments and \@ with a number unique to the expansion
+
+    Returns a list of SourceLines and a list of the files included.
+    """
+
+    filename = getattr(inputfile, "name", "-")
+
+    lines = []
+    includes = []
+
+    macros = {}  # NAME -> (params, body, file, line)
+    included = set()  # real paths of the files included so far
+    expansions = 0
+
+    def add(text, file, line_num, macro):
+        """Emit a line, or expand it if it's a macro invocation"""
+
+        nonlocal expansions
+
+        m = re.match(REGEX_INVOKE, text)
+
+        if m is None or m.group(2).upper() not in macros:
+            lines.append(SourceLine(text, file, line_num, macro))
+            return
+
+        here = SourceLine(text, file, line_num, macro)
+        name = m.group(2).upper()
+        params, body, def_file, _ = macros[name]
+
+        if len(macro) >= MAX_MACRO_DEPTH:
+            print(f"{file}:{line_num}: macro {name} nested more than "
+                  f"{MAX_MACRO_DEPTH} deep, expanded at {macro[-1][1]}",
+                  file=sys.stderr)
+            sys.exit(1)
+
+        args = [a.strip() for a in m.group(3).split(",")] \
+            if m.group(3) else []
+
+        if len(args) != len(params):
+            print(f"{location(here)}: macro {name} takes {len(params)} "
+                  f"arguments, got {len(args)}", file=sys.stderr)
+            sys.exit(1)
+
+        # A label on the invocation labels the first expanded line
+        if m.group(1) is not None:
+            lines.append(SourceLine(f"{m.group(1)}:", file, line_num, macro))
+
+        expansions += 1
+        values = {p.upper(): a for p, a in zip(params, args)}
+        values["@"] = str(expansions)
+        inner = ((name, f"{file}:{line_num}"),) + macro
+
+        def substitute(m):
+            if m.group(1).upper() not in values:
+                print(f"{location(body_line)}: unknown macro parameter "
+                      f"\\{m.group(1)}", file=sys.stderr)
+                sys.exit(1)
+
+            return values[m.group(1).upper()]
+
+        for body_num, body_text in body:
+            body_line = SourceLine(body_text, def_file, body_num, inner)
+            body_text = re.sub(REGEX_MACRO_ARG, substitute, body_text)
+
+            m = re.match(REGEX_INCLUDE, body_text, re.IGNORECASE)
+
+            if m is not None:
+                include(m.group(1), body_line)
+            else:
+                add(body_text, def_file, body_num, inner)
+
+    def include(name, here):
+        """Paste in an included file"""
+
+        path = os.path.join(os.path.dirname(here.file), name)
+
+        try:
+            real = os.path.realpath(path)
+
+            if real in included:
+                return
+
+            included.add(real)
+            items = load_unit(path)
+
+        except OSError as e:
+            print(f"{location(here)}: can't include {name}: {e.strerror}",
+                  file=sys.stderr)
+            sys.exit(1)
+
+        includes.append(path)
+        unit(items, path, here.macro)
+
+    def unit(items, file, macro):
+        """Preprocess the scanned items of one file"""
+
+        for item in items:
+            if item[0] == "line":
+                add(item[2], file, item[1], macro)
+
+            elif item[0] == "include":
+                include(item[2], SourceLine("", file, item[1], macro))
+
+            else:
+                _, line_num, name, params, body = item
+
+                if name in OPCODES or name in ("DS", "DB"):
+                    print(f"{file}:{line_num}: macro {name} would hide "
+                          f"the {name} instruction", file=sys.stderr)
+                    sys.exit(1)
+
+                if name in macros:
+                    _, _, prev_file, prev_line = macros[name]
+                    print(f"{file}:{line_num}: macro {name} already defined "
+                          f"at {prev_file}:{prev_line}", file=sys.stderr)
+                    sys.exit(1)
+
+                macros[name] = (params, body, file, line_num)
+
+    included.add(os.path.realpath(filename))
+
+    unit(scan_unit(inputfile.read(), filename), filename, ())
+
+    return lines, includes
+
+
+def pass1(lines, sym, code, debug=None, extensions=(), strict=False):
     """
     Pass 1
 
-    * Read the source code lines
+    * Go through the preprocessed source lines
     * Parse labels, opcodes, and operands
     * Record label offsets
     * Emit machine code
+    * If a debug dict is given, record [start, end, line] address ranges in
+      debug["lines"], with a fourth element indexing debug["files"] for
+      lines not from the first file, and labels, as written, in
+      debug["symbols"]
+    * Reject extension instructions whose extension isn't in extensions or
+      turned on by an earlier .ext directive; with strict, reject .ext too
     """
 
-    # Source line number
-    line_num = 0
+    extensions = set(extensions)
+
+    # Where the current line came from, for error messages
+    where = None
 
     # Current code address (for labels)
     addr = 0
@@ -146,13 +516,11 @@ def pass1(inputfile, sym, code):
     def get_reg(op, fatal=True):
         """Get a register number from a string, e.g. "R2" -> 2"""
 
-        nonlocal line_num
-
         m = re.match(r"R([0-7])", op)
 
         if m is None:
             if fatal:
-                print(f"Line {line_num}: unknown register {op}",
+                print(f"{where}: unknown register {op}",
                       file=sys.stderr)
                 sys.exit(1)
             else:
@@ -160,7 +528,7 @@ def pass1(inputfile, sym, code):
 
         return int(m.group(1))
 
-    def out0(opcode, op_a, op_b, machine_code):
+    def out0(opcode, op_a, op_b, op_c, machine_code):
         """Handle opcodes with zero operands"""
 
         nonlocal addr
@@ -168,7 +536,7 @@ def pass1(inputfile, sym, code):
         code.append(f"{machine_code} # {opcode}")
         addr += 1
 
-    def out1(opcode, op_a, op_b, machine_code):
+    def out1(opcode, op_a, op_b, op_c, machine_code):
         """Handle opcodes with one operand"""
 
         nonlocal addr
@@ -178,7 +546,7 @@ def pass1(inputfile, sym, code):
         code.append(p8(reg_a))
         addr += 2
 
-    def out2(opcode, op_a, op_b, machine_code):
+    def out2(opcode, op_a, op_b, op_c, machine_code):
         """Handle opcodes with two operands"""
 
         nonlocal addr
@@ -192,7 +560,23 @@ def pass1(inputfile, sym, code):
 
         addr += 3
 
-    def out8(opcode, op_a, op_b, machine_code):
+    def out3(opcode, op_a, op_b, op_c, machine_code):
+        """Handle opcodes with three operands"""
+
+        nonlocal addr
+
+        reg_a = get_reg(op_a)
+        reg_b = get_reg(op_b)
+        reg_c = get_reg(op_c)
+
+        code.append(f"{machine_code} # {opcode} {op_a},{op_b},{op_c}")
+        code.append(p8(reg_a))
+        code.append(p8(reg_b))
+        code.append(p8(reg_c))
+
+        addr += 4
+
+    def out8(opcode, op_a, op_b, op_c, machine_code):
         """Handle LDI opcode (type 8)"""
 
         nonlocal addr
@@ -223,7 +607,7 @@ def pass1(inputfile, sym, code):
         m = re.match(REGEX_DS, line, re.IGNORECASE)
 
         if m is None or m.group(2) is None:
-            print(f"line {line_num}: missing argument to DS", file=sys.stderr)
+            print(f"{where}: missing argument to DS", file=sys.stderr)
             sys.exit(2)
 
         data = m.group(2)
@@ -248,7 +632,7 @@ def pass1(inputfile, sym, code):
         m = re.match(REGEX_DB, line, re.IGNORECASE)
 
         if m is None or m.group(2) is None:
-            print(f"line {line}: missing argument to DB", file=sys.stderr)
+            print(f"{where}: missing argument to DB", file=sys.stderr)
             sys.exit(2)
 
         data = m.group(2)
@@ -257,7 +641,7 @@ def pass1(inputfile, sym, code):
             val = int(data, 0)
 
         except ValueError:
-            print(f"line {line_num}: invalid integer argument to DB",
+            print(f"{where}: invalid integer argument to DB",
                   file=sys.stderr)
             sys.exit(2)
 
@@ -268,23 +652,50 @@ def pass1(inputfile, sym, code):
 
         addr += 1
 
-    def check_ops(opcode, op_a, op_b):
+    def handle_ext(names):
+        """
+        Handle the .ext directive
+        """
+
+        names = [n.strip().lower() for n in names.split(",") if n.strip()]
+        unknown = [n for n in names if n not in EXTENSIONS]
+
+        if not names or unknown:
+            print(f"{where}: .ext takes a list of extensions: "
+                  f"{', '.join(EXTENSIONS)}", file=sys.stderr)
+            sys.exit(2)
+
+        if strict:
+            print(f"{where}: .ext {','.join(names)} isn't allowed with "
+                  f"--strict", file=sys.stderr)
+            sys.exit(2)
+
+        extensions.update(names)
+
+    def check_ops(opcode, op_a, op_b, op_c):
         """Check operands for sanity with a particular opcode"""
 
         def check_ops_count(desired, found):
             # Makes sure we have right operand count
             if found < desired:
-                print(f"Line {line_num}: missing operand to {opcode}",
+                print(f"{where}: missing operand to {opcode}",
                       file=sys.stderr)
                 sys.exit(1)
             elif found > desired:
-                print(f"Line {line_num}: unexpected operand to {opcode}",
+                print(f"{where}: unexpected operand to {opcode}",
                       file=sys.stderr)
                 sys.exit(1)
 
         # Make sure we know this opcode at all
         if opcode not in OPCODES:
-            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
+            print(f"{where}: unknown opcode {opcode}", file=sys.stderr)
+            sys.exit(2)
+
+        # And that its ISA extension, if any, is enabled
+        ext = OPCODES[opcode].get("ext")
+        if ext is not None and ext not in extensions:
+            print(f"{where}: {opcode} needs the {ext} ISA extension "
+                  f"(.ext {ext} or -x {ext})", file=sys.stderr)
             sys.exit(2)
 
         op_type = OPCODES[opcode]["type"]
@@ -297,8 +708,11 @@ def pass1(inputfile, sym, code):
         if op_b is not None:
             total_operands += 1
 
-        if op_type == 0 or op_type == 1 or op_type == 2:
-            # 0, 1, or 2 register operands
+        if op_c is not None:
+            total_operands += 1
+
+        if op_type == 0 or op_type == 1 or op_type == 2 or op_type == 3:
+            # 0, 1, 2 or 3 register operands
             check_ops_count(op_type, total_operands)
 
         elif op_type == 8:
@@ -310,32 +724,33 @@ def pass1(inputfile, sym, code):
         0: out0,
         1: out1,
         2: out2,
+        3: out3,
         8: out8,
     }
 
-    for line in inputfile:
-        line_num += 1
+    # Index of each source file in debug["files"]
+    file_index = {}
+    if debug is not None:
+        file_index = {f: i for i, f in enumerate(debug["files"])}
 
-        # Strip comments
-        comment_index = line.find(';')
-        if comment_index != -1:
-            line = line[:comment_index]
+    for source_line in lines:
+        line = source_line.text
+        where = location(source_line)
 
-        # Normalize
-        line = line.strip()
+        m = re.match(REGEX_EXT, line, re.IGNORECASE)
 
-        # Ignore blank lines
-        if input == '':
+        if m is not None:
+            handle_ext(m.group(1))
             continue
 
-        # print(line)  # debug
-
         m = re.match(REGEX, line)
 
         if m is not None:
-            label, opcode, op_a, op_b = normalize_line(m.groups())
+            label, opcode, op_a, op_b, op_c = normalize_line(m.groups())
+
+            # print(label, opcode, op_a, op_b, op_c)  # debug
 
-            # print(label, opcode, op_a, op_b)  # debug
+            start_addr = addr
 
             # Track label address
             if label is not None:
@@ -343,6 +758,9 @@ def pass1(inputfile, sym, code):
                 # print(f"Label {label}: {addr}")  # debug
                 code.append(f'# {label} (address {addr}):')
 
+                if debug is not None:
+                    debug["symbols"][m.group(1)] = addr
+
             if opcode is not None:
                 if opcode == 'DS':
                     handle_ds(line)
@@ -350,14 +768,23 @@ def pass1(inputfile, sym, code):
                     handle_db(line)
                 else:
                     # Check operand count
-                    check_ops(opcode, op_a, op_b)
+                    check_ops(opcode, op_a, op_b, op_c)
 
                     # Handle opcodes
                     op_info = OPCODES[opcode]
                     handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
+                    handler(opcode, op_a, op_b, op_c, op_info["code"])
+
+            if debug is not None and addr > start_addr:
+                if source_line.file not in file_index:
+                    file_index[source_line.file] = len(debug["files"])
+                    debug["files"].append(source_line.file)
+
+                index = file_index[source_line.file]
+                span = [start_addr, addr, source_line.line]
+                debug["lines"].append(span + [index] if index else span)
         else:
-            print(f"No match: {input}", file=sys.stderr)
+            print(f"{where}: no match: {line}", file=sys.stderr)
             sys.exit(3)
 
 
@@ -381,12 +808,42 @@ def pass2(outputfile, sym, code):
         outputfile.write(f"{c}\n")
 
 
-def main(argv):
-    # Parse command line
-    inputfile, outputfile = parse_commandline(argv)
+def write_debug(debugfile, debug):
+    """
+    Write the debug info sidecar: compact JSON with the source file name,
+    [start, end, line] address ranges (end exclusive) and label addresses.
+    If code came from included files too, they're listed in "files", after
+    the source file and relative to it, and their ranges have a fourth
+    element indexing that list.
+    """
 
-    # Open files
-    inputfile, outputfile = open_files(inputfile, outputfile)
+    source = debug["files"][0]
+    base = os.path.dirname(source)
+
+    info = {
+        "version": 1,
+        "source": os.path.basename(source),
+        "lines": debug["lines"],
+        "symbols": debug["symbols"],
+    }
+
+    if len(debug["files"]) > 1:
+        info["files"] = [info["source"]] + \
+            [os.path.relpath(f, base) for f in debug["files"][1:]]
+
+    debugfile.write(json.dumps(info, separators=(",", ":")))
+    debugfile.write("\n")
+
+
+def assemble(inputfile, outputfile, debugfile=None, extensions=(),
+             strict=False):
+    """
+    Assemble source read from inputfile into machine code written to
+    outputfile, and debug info to debugfile if given. Only the ISA
+    extensions named in extensions, or turned on by .ext directives unless
+    strict, are accepted. Errors are reported on stderr and exit, like the rest of the
+    assembler. Returns the list of files included, so builds can track them.
+    """
 
     # Set up the symbol table
     sym = {}
@@ -394,10 +851,42 @@ def main(argv):
     # Set up the machine code output
     code = []
 
+    # Set up the debug info
+    debug = {"lines": [], "symbols": {},
+             "files": [getattr(inputfile, "name", "-")]}
+
     # Assemble
-    pass1(inputfile, sym, code)
+    lines, includes = preprocess(inputfile)
+    pass1(lines, sym, code, debug, extensions, strict)
     pass2(outputfile, sym, code)
 
+    if debugfile is not None:
+        write_debug(debugfile, debug)
+
+    return includes
+
+
+def debug_filename(outputfile):
+    """call.ls8 -> call.dbg"""
+
+    return os.path.splitext(outputfile)[0] + ".dbg"
+
+
+def main(argv):
+    # Parse command line
+    inputname, outputname, extensions, strict, debug = \
+        parse_commandline(argv)
+
+    # Open files
+    inputfile, outputfile = open_files(inputname, outputname)
+
+    # Debug info goes next to the output file, if there is one
+    debugfile = None
+    if debug and outputname != "-":
+        debugfile = open(debug_filename(outputname), "w")
+
+    assemble(inputfile, outputfile, debugfile, extensions, strict)
+
     return 0
 
 
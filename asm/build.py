@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+# Incremental, parallel build of LS-8 assembly sources
+#
+# Assembles every .asm file in a source directory into a .ls8 file in an
+# output directory, like buildall used to, but:
+#
+#  * skips sources whose contents, .include'd files and assembler haven't
+#    changed since the last build, going by the hashes in a small manifest
+#    file
+#  * assembles the rest in a process pool, writing each program's debug
+#    info (.dbg) next to it
+#  * prints one summary with per-file timings and errors
+#
+# The .dbg files for ../ls8/examples are checked in with the .ls8 files, so
+# rebuild them together.
+#
+# Usage: build.py [-f] [--no-debug] [srcdir [outdir]]
+#
+#  -f          rebuild everything
+#  --no-debug  don't write .dbg files
+#  srcdir   defaults to the directory this script is in
+#  outdir   defaults to ../ls8/examples
+
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr
+
+import asm
+
+ASM_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(ASM_DIR, "..", "ls8", "examples")
+
+# Lives in the output directory, next to what it describes
+MANIFEST = ".build-manifest.json"
+
+
+def file_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def assembler_version():
+    """Changes whenever the assembler itself does."""
+    return file_hash(asm.__file__)
+
+
+def load_manifest(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(filename, manifest):
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, filename)
+
+
+def include_hashes(srcdir, includes):
+    """{path relative to srcdir: hash} for the files a source included."""
+    return {os.path.relpath(path, srcdir): file_hash(path)
+            for path in includes}
+
+
+def up_to_date(srcdir, entry, old_entry):
+    """
+    Whether a source with manifest entry `entry` (source and assembler
+    hashes) was last built from the same source, assembler and includes.
+    """
+    if old_entry is None:
+        return False
+
+    includes = old_entry.get("includes", {})
+
+    if dict(entry, includes=includes) != old_entry:
+        return False
+
+    for path, digest in includes.items():
+        try:
+            if file_hash(os.path.join(srcdir, path)) != digest:
+                return False
+        except OSError:
+            return False
+
+    return True
+
+
+def build_one(source, output, debug=True):
+    """
+    Assemble one file. Runs in a worker process. Returns (ok, seconds,
+    error text, files included). The output, and its debug info if debug,
+    is only replaced if assembly succeeds.
+    """
+    start = time.perf_counter()
+    errors = io.StringIO()
+    machine_code = io.StringIO()
+    debug_info = io.StringIO() if debug else None
+
+    try:
+        with open(source) as inputfile, redirect_stderr(errors):
+            includes = asm.assemble(inputfile, machine_code, debug_info)
+
+    except SystemExit:
+        return False, time.perf_counter() - start, \
+            errors.getvalue().strip(), []
+
+    except OSError as e:
+        return False, time.perf_counter() - start, str(e), []
+
+    outputs = [(output, machine_code)]
+    if debug:
+        outputs.append((asm.debug_filename(output), debug_info))
+
+    for filename, text in outputs:
+        tmp = filename + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text.getvalue())
+        os.replace(tmp, filename)
+
+    return True, time.perf_counter() - start, "", includes
+
+
+def build(srcdir=ASM_DIR, outdir=OUTPUT_DIR, force=False, workers=None,
+          debug=True):
+    """Build all stale sources. Returns the number of failures."""
+    start = time.perf_counter()
+
+    manifest_file = os.path.join(outdir, MANIFEST)
+    manifest = {} if force else load_manifest(manifest_file)
+    version = assembler_version()
+
+    sources = sorted(f for f in os.listdir(srcdir) if f.endswith(".asm"))
+    stale = []
+    new_manifest = {}
+
+    for name in sources:
+        source = os.path.join(srcdir, name)
+        output = os.path.join(outdir, name[:-4] + ".ls8")
+        entry = {"source": file_hash(source), "assembler": version}
+
+        if up_to_date(srcdir, entry, manifest.get(name)) and \
+                os.path.exists(output) and \
+                (not debug or os.path.exists(asm.debug_filename(output))):
+            new_manifest[name] = manifest[name]
+        else:
+            stale.append((name, source, output, entry))
+
+    results = []
+
+    if len(stale) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(build_one, source, output, debug)
+                       for _, source, output, _ in stale]
+            results = [future.result() for future in futures]
+
+    elif stale:
+        _, source, output, _ = stale[0]
+        results = [build_one(source, output, debug)]
+
+    failures = 0
+
+    for (name, _, _, entry), (ok, seconds, error, includes) in \
+            zip(stale, results):
+        if ok:
+            new_manifest[name] = dict(entry, includes=include_hashes(
+                srcdir, includes))
+            print(f"  built   {name:<24} {1000 * seconds:7.1f} ms")
+        else:
+            failures += 1
+            print(f"  FAILED  {name:<24} {1000 * seconds:7.1f} ms")
+            for line in error.splitlines():
+                print(f"          {line}")
+
+    save_manifest(manifest_file, new_manifest)
+
+    print(f"{len(stale) - failures} built, {failures} failed, "
+          f"{len(sources) - len(stale)} up to date "
+          f"in {time.perf_counter() - start:.3f}s")
+
+    return failures
+
+
+def main(argv):
+    args = [a for a in argv[1:] if a not in ("-f", "--no-debug")]
+
+    if len(args) > 2:
+        print("usage: build.py [-f] [--no-debug] [srcdir [outdir]]",
+              file=sys.stderr)
+        return 1
+
+    srcdir = args[0] if len(args) > 0 else ASM_DIR
+    outdir = args[1] if len(args) > 1 else OUTPUT_DIR
+
+    return 1 if build(srcdir, outdir, force="-f" in argv,
+                      debug="--no-debug" not in argv) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
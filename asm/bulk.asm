@@ -0,0 +1,32 @@
+; Block memory extension instructions
+;
+; Fills a buffer, copies a string over it and prints each in one go. Needs
+; the bulk ISA extension, so it won't assemble with asm.py --strict.
+;
+; Expected output:
+; ********
+; Hello, world!
+
+    .ext bulk
+
+    LDI R0,Buffer
+    LDI R1,42            ; '*'
+    LDI R2,8
+    MEMSET R0,R1,R2      ; fill 8 bytes of Buffer with '*'
+    PRS R0,R2            ; and print them
+    LDI R1,10
+    PRA R1               ; newline
+
+    LDI R1,Hello
+    LDI R2,14
+    MEMCPY R0,R1,R2      ; copy the 14 bytes of Hello to Buffer
+    PRS R0,R2            ; and print them
+    HLT
+
+Hello:
+    ds Hello, world!
+    db 0x0a
+
+; Free RAM up to the stack
+Buffer:
+    db 0
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+"""Precomputed ALU result and flag tables.
+
+With 8-bit operands every binary ALU operation has only 256 * 256 inputs, so
+each one can be a 64K table indexed by `a << 8 | b`, and CMP can be a table
+of flag values. CPU.run() then does a single bytes lookup per ALU
+instruction instead of going through alu().
+
+The tables are built with NumPy when it's installed, in pure Python when
+it isn't, and cached in __pycache__ so later runs just read 640K off disk.
+
+Usage:
+
+    python3 alu_tables.py
+
+benchmarks the table-driven ALU against the arithmetic one.
+"""
+
+import os
+import sys
+import time
+
+from cpu import (CPU, ADD, SUB, MUL, AND, OR, XOR, MOD, SHL, SHR, CMP,
+                 LDI, JNE, HLT, flagL, flagG, flagE)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bump when a table's contents change, so stale caches are ignored
+VERSION = 1
+MAGIC = b"LS8ALU%02d" % VERSION
+
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     "__pycache__", "alu_tables.bin")
+
+TABLE_SIZE = 256 * 256
+
+# Every table as a function of (a, b). These work on plain ints and on
+# NumPy arrays alike. MOD by zero is never looked up, see CPU.run().
+OPERATIONS = [
+    (ADD, lambda a, b: (a + b) & 0xFF),
+    (SUB, lambda a, b: (a - b) & 0xFF),
+    (MUL, lambda a, b: (a * b) & 0xFF),
+    (AND, lambda a, b: a & b),
+    (OR, lambda a, b: a | b),
+    (XOR, lambda a, b: a ^ b),
+    (MOD, lambda a, b: a % (b + (b == 0))),
+    (SHL, lambda a, b: (a << b) & 0xFF),
+    (SHR, lambda a, b: a >> b),
+]
+
+
+def _cmp(a, b):
+    if a == b:
+        return flagE
+    elif a < b:
+        return flagL
+    return flagG
+
+
+def build_numpy():
+    a = np.arange(256, dtype=np.int64).reshape(256, 1)
+    b = np.arange(256, dtype=np.int64).reshape(1, 256)
+
+    tables = []
+
+    for op, f in OPERATIONS:
+        if op in (SHL, SHR):
+            # shifts past the word size are 0, NumPy's wrap around instead
+            result = np.where(b < 64, f(a, np.minimum(b, 63)), 0)
+        else:
+            result = f(a, b)
+
+        tables.append((result & 0xFF).astype(np.uint8).tobytes())
+
+    flags = np.where(a == b, flagE, np.where(a < b, flagL, flagG))
+    tables.append(flags.astype(np.uint8).tobytes())
+
+    return tables
+
+
+def build_python():
+    tables = []
+
+    for _, f in OPERATIONS:
+        tables.append(bytes(f(a, b) for a in range(256) for b in range(256)))
+
+    tables.append(bytes(_cmp(a, b) for a in range(256) for b in range(256)))
+
+    return tables
+
+
+def build():
+    """Compute all the tables: the OPERATIONS tables then the CMP table."""
+    if np is not None:
+        return build_numpy()
+    return build_python()
+
+
+def load(cache=CACHE):
+    """
+    Return ({opcode: table}, cmp_table), from the cache if it's there and
+    current, otherwise building it and refreshing the cache.
+    """
+    tables = None
+
+    try:
+        with open(cache, "rb") as f:
+            data = f.read()
+
+        if data[:len(MAGIC)] == MAGIC and \
+                len(data) == len(MAGIC) + TABLE_SIZE * (len(OPERATIONS) + 1):
+            data = data[len(MAGIC):]
+            tables = [data[i:i + TABLE_SIZE]
+                      for i in range(0, len(data), TABLE_SIZE)]
+
+    except OSError:
+        pass
+
+    if tables is None:
+        tables = build()
+
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            with open(cache, "wb") as f:
+                f.write(MAGIC + b"".join(tables))
+        except OSError:
+            # read-only checkout, just build them every time
+            pass
+
+    alu_tables = {op: table for (op, _), table in zip(OPERATIONS, tables)}
+
+    return alu_tables, tables[-1]
+
+
+def enable(cpu, cache=CACHE):
+    """Switch a CPU over to the table-driven ALU."""
+    cpu.alu_tables, cpu.cmp_table = load(cache)
+
+
+def benchmark_program(iterations=250):
+    """Machine code for an ALU-heavy loop: 9 ALU ops + CMP per pass."""
+    code = [
+        LDI, 0, 0,  # R0 = 0, loop counter
+        LDI, 1, 1,
+        LDI, 2, iterations,
+        LDI, 3, 7,
+        LDI, 4, 3,
+        LDI, 6, 18,  # R6 = loop address
+        # loop:
+        ADD, 3, 4,
+        MUL, 3, 4,
+        SUB, 3, 1,
+        XOR, 3, 0,
+        AND, 3, 3,
+        OR, 3, 4,
+        SHL, 3, 1,
+        SHR, 3, 1,
+        MOD, 3, 4,
+        ADD, 0, 1,
+        CMP, 0, 2,
+        JNE, 6,
+        HLT,
+    ]
+
+    return code + [0] * (256 - len(code))
+
+
+def run_benchmark(tables, runs=400):
+    """Run the benchmark program `runs` times, return instructions/second."""
+    program = benchmark_program()
+    start = time.perf_counter()
+    instructions = 0
+
+    for _ in range(runs):
+        cpu = CPU()
+        cpu.idle_sleep = False
+        cpu.ram[:] = program
+
+        if tables is not None:
+            cpu.alu_tables, cpu.cmp_table = tables
+
+        cpu.run()
+        instructions += cpu.instructions
+
+    return instructions / (time.perf_counter() - start), cpu.reg
+
+
+def main(argv):
+    timings = []
+
+    start = time.perf_counter()
+    build_python()
+    timings.append(("build (pure Python)", time.perf_counter() - start))
+
+    if np is not None:
+        start = time.perf_counter()
+        build_numpy()
+        timings.append(("build (NumPy)", time.perf_counter() - start))
+
+    if os.path.exists(CACHE):
+        os.remove(CACHE)
+    load()
+
+    start = time.perf_counter()
+    tables = load()
+    timings.append(("load from cache", time.perf_counter() - start))
+
+    for name, seconds in timings:
+        print(f"{name:<24} {1000 * seconds:8.1f} ms")
+
+    size = sum(len(t) for t in tables[0].values()) + len(tables[1])
+    print(f"{'table memory':<24} {size // 1024:8d} KiB")
+
+    arithmetic, reg_a = run_benchmark(None)
+    table, reg_t = run_benchmark(tables)
+
+    if reg_a != reg_t:
+        print(f"MISMATCH: arithmetic {reg_a}, tables {reg_t}")
+        return 1
+
+    print(f"{'arithmetic ALU':<24} {arithmetic:8.0f} instructions/s")
+    print(f"{'table ALU':<24} {table:8.0f} instructions/s "
+          f"({100 * (table / arithmetic - 1):+.1f}%)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
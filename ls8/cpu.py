@@ -1,11 +1,93 @@
 """CPU functionality."""
 
 import sys
+import time
+
+from debuginfo import DebugInfo
+from devices import Devices
 
 flagL = 0b00000100
 flagG = 0b00000010
 flagE = 0b00000001
 
+# Instruction opcodes
+HLT = 0b00000001
+LDI = 0b10000010
+PRN = 0b01000111
+MUL = 0b10100010
+ADD = 0b10100000
+SUB = 0b10100001
+DIV = 0b10100011
+PUSH = 0b01000101
+POP = 0b01000110
+CALL = 0b01010000
+RET = 0b00010001
+CMP = 0b10100111
+JMP = 0b01010100
+JEQ = 0b01010101
+JNE = 0b01010110
+ST = 0b10000100
+PRA = 0b01001000
+IRET = 0b00010011
+AND = 0b10101000
+OR = 0b10101010
+XOR = 0b10101011
+NOT = 0b01101001
+SHL = 0b10101100
+SHR = 0b10101101
+MOD = 0b10100100
+LD = 0b10000011
+NOP = 0b00000000
+
+# Extension opcodes for multi-core machines, see multicore.py
+CAS = 0b10001000  # compare-and-swap
+TAS = 0b10001001  # test-and-set
+
+# Extension opcodes for block memory operations, run as slice operations
+MEMCPY = 0b11000001  # copy a block
+MEMSET = 0b11000010  # fill a block
+PRS = 0b10001010  # print a block as characters
+
+# Reserved registers
+IM = 5  # interrupt mask
+IS = 6  # interrupt status
+
+VECTOR_TABLE = 0xF8  # I0-I7 handler addresses live at F8-FF
+
+# Devices are polled for interrupts once per this many instructions
+POLL_INTERVAL = 256
+
+# Clock cycles each instruction takes, for the timing model. Memory
+# accesses and the slower ALU operations cost extra.
+CYCLE_COSTS = [1] * 256
+for op, cost in ((MUL, 3), (DIV, 3), (MOD, 3),
+                 (LD, 2), (ST, 2), (PUSH, 2), (POP, 2),
+                 (CALL, 3), (RET, 2), (IRET, 10), (CAS, 3), (TAS, 3),
+                 (MEMCPY, 3), (MEMSET, 3), (PRS, 2)):
+    CYCLE_COSTS[op] = cost
+
+# Block operations cost one more cycle per this many bytes
+BULK_BYTES_PER_CYCLE = 2
+
+# Cycles to save the machine state and enter an interrupt handler
+INTERRUPT_CYCLES = 10
+
+# Longest backward jump (in bytes) that is checked for being an idle loop
+IDLE_LOOP_MAX = 16
+
+# Instructions that leave the machine in the same state however often they
+# run back to back, so a loop made only of these can never make progress
+# on its own
+IDEMPOTENT = {LDI, NOP}
+
+# ISA extensions, instructions that aren't in the LS-8 spec (see
+# ../asm/asm.py), and their opcodes. A CPU runs only the extensions in its
+# `extensions` set; with it empty, it is a spec LS-8.
+EXTENSIONS = {
+    "atomic": (CAS, TAS),
+    "bulk": (MEMCPY, MEMSET, PRS),
+}
+
 # CPU = Central Processing Unit
 
 
@@ -23,6 +105,48 @@ class CPU:
         self.reg[7] = self.sp
         self.flag = 0
         self.running = True
+        # objects with a step(cpu, ir, op_a, op_b) method, called before each
+        # instruction executes (profilers, tracers, ...)
+        self.observers = []
+
+        self.interrupts_enabled = True
+        self.devices = Devices()  # timer and keyboard
+        # sleep in idle spin loops until the next interrupt instead of
+        # executing them
+        self.idle_sleep = True
+        self.idle_loops = {}  # (target, pc) -> is it an idle loop
+
+        self.cycles = 0  # clock cycles executed, plus idle fast-forward
+        self.idle_time = 0  # seconds spent asleep in idle loops
+        self.idle_cycles = 0  # cycles skipped while asleep
+        self.start_time = None
+        self.poll_interval = POLL_INTERVAL
+        # instructions until the next device poll, kept across run() calls
+        # so running in slices polls at the same points as running straight
+        # through
+        self.poll_countdown = None
+        self.throttle = None  # see throttle.py
+        self.exporter = None  # see metrics.py
+        self.shared_state = None  # see sharedstate.py
+        self.io_log = None  # device event recorder or replayer, see iolog.py
+        # opcode -> 64K result table, and the CMP flag table; see
+        # alu_tables.py
+        self.alu_tables = None
+        self.cmp_table = None
+        # lock held around CAS/TAS when cores share RAM across processes
+        self.atomic = None
+        # ISA extensions this CPU runs, see EXTENSIONS
+        self.extensions = set(EXTENSIONS)
+        # source lines and labels for the loaded program, if the assembler
+        # left a .dbg file next to it
+        self.debug_info = None
+
+        # Metrics, see metrics(). Instructions are counted once per poll.
+        self.instructions = 0
+        self.interrupts_raised = 0
+        self.interrupts_serviced = 0
+        self.stack_low = self.sp  # stack high-water mark (lowest SP)
+        self.output_bytes = 0
 
      # read RAM at given address
      # MAR - Memory Address Register
@@ -34,18 +158,102 @@ class CPU:
     def ram_write(self, mdr, mar):
         self.ram[mar] = mdr
 
-    def load(self):
+    def instrumented(self):
+        """Have ram_read() or ram_write() been replaced on this CPU?"""
+        return "ram_read" in self.__dict__ or "ram_write" in self.__dict__
+
+    def extension_disabled(self, ir):
+        """Stop at an instruction from an ISA extension that is off."""
+        name = next(name for name, ops in EXTENSIONS.items() if ir in ops)
+
+        print(f"A system error occurred! Instruction {ir:08b} at "
+              f"{self.where()} needs the {name} ISA extension. Program "
+              f"stopped!")
+        self.running = False
+
+    def block_length(self, length, *addrs):
+        """length, cut short so blocks at addrs stop at the end of RAM."""
+        return max(0, min(length, *(len(self.ram) - addr for addr in addrs)))
+
+    def cycle_cost(self, ir, op_a, op_b):
+        """Cycles the instruction at PC takes, as run() counts them."""
+        reg = self.reg
+
+        if ir == MEMCPY:
+            n = self.block_length(reg[self.ram[self.pc + 3]], reg[op_a],
+                                  reg[op_b])
+        elif ir == MEMSET:
+            n = self.block_length(reg[self.ram[self.pc + 3]], reg[op_a])
+        elif ir == PRS:
+            n = self.block_length(reg[op_b], reg[op_a])
+        else:
+            return CYCLE_COSTS[ir]
+
+        return CYCLE_COSTS[ir] + n // BULK_BYTES_PER_CYCLE
+
+    def mem_copy(self, dst, src, length):
+        """
+        Copy length bytes from src to dst. Overlapping blocks are copied as
+        if through a buffer, like memmove. Blocks stop at the end of RAM.
+        Returns the number of bytes copied.
+        """
+        length = self.block_length(length, dst, src)
+
+        if self.instrumented():
+            # byte by byte, so every access is seen
+            data = [self.ram_read(src + i) for i in range(length)]
+            for i, value in enumerate(data):
+                self.ram_write(value, dst + i)
+        else:
+            self.ram[dst:dst + length] = self.ram[src:src + length]
+
+        return length
+
+    def mem_set(self, addr, value, length):
+        """Fill length bytes at addr with value. Returns the bytes set."""
+        length = self.block_length(length, addr)
+
+        if self.instrumented():
+            for i in range(length):
+                self.ram_write(value, addr + i)
+        else:
+            # bytes, not a list, so memoryview RAM works too
+            self.ram[addr:addr + length] = bytes((value,)) * length
+
+        return length
+
+    def print_block(self, addr, length):
+        """Print length bytes at addr as characters, like PRA does one."""
+        length = self.block_length(length, addr)
+
+        if self.instrumented():
+            data = [self.ram_read(addr + i) for i in range(length)]
+        else:
+            data = self.ram[addr:addr + length]
+
+        print("".join(map(chr, data)), end='', flush=True)
+        self.output_bytes += length
+
+        return length
+
+    def load(self, filename=None):
         """Load a program into memory. Open a program file, read its contents and 
-        save appropriate data into RAM"""
+        save appropriate data into RAM. The file name defaults to the first
+        command line argument. Returns the program's size in bytes."""
         address = 0
 
         try:
-            if len(sys.argv) < 2:
-                print(f'Error from {sys.argv[0]}: missing filename argument')
-                print(f'Usage: python3 {sys.argv[0]} <somefilename>')
-                sys.exit(1)
+            if filename is None:
+                if len(sys.argv) < 2:
+                    print(f'Error from {sys.argv[0]}: missing filename argument')
+                    print(f'Usage: python3 {sys.argv[0]} <somefilename>')
+                    sys.exit(1)
+
+                filename = sys.argv[1]
 
-            with open(sys.argv[1]) as f:
+            self.debug_info = DebugInfo.for_program(filename)
+
+            with open(filename) as f:
                 for line in f:
                     split_line = line.split('#')[0]
                     stripped_split_line = split_line.strip()
@@ -59,27 +267,35 @@ class CPU:
                         address += 1
 
         except FileNotFoundError:
-            print(f'Error from {sys.argv[0]}: {sys.argv[1]} not found')
+            print(f'Error from {sys.argv[0]}: {filename} not found')
             print("(Did you double check the file name?)")
 
+        # number of bytes loaded
+        return address
+
     # Arithmetic logic unit
     def alu(self, op, reg_a, reg_b):
         """ALU operations."""
         # Add the value in two registers and store the result in registerA.
         if op == "ADD":
-            self.reg[reg_a] += self.reg[reg_b]
+            self.reg[reg_a] = (self.reg[reg_a] + self.reg[reg_b]) & 0xFF
 
         # Subtract the value in the second register from the first, storing the result in registerA.
         elif op == "SUB":
-            self.reg[reg_a] -= self.reg[reg_b]
+            self.reg[reg_a] = (self.reg[reg_a] - self.reg[reg_b]) & 0xFF
 
         # Multiply the values in two registers together and store the result in registerA.
         elif op == "MUL":
-            self.reg[reg_a] *= self.reg[reg_b]
+            self.reg[reg_a] = (self.reg[reg_a] * self.reg[reg_b]) & 0xFF
 
         # Divide the value in the first register by the value in the second, storing the result in registerA.
+        # If the value in the second register is 0, the system should print an error message and halt.
         elif op == "DIV":
-            self.reg[reg_a] /= self.reg[reg_b]
+            if self.reg[reg_b] == 0:
+                print(f"A system error occurred! Division by zero at {self.where()}. Program stopped!")
+                self.running = False
+            else:
+                self.reg[reg_a] //= self.reg[reg_b]
 
         # Bitwise-AND the values in registerA and registerB, then store the result in registerA.
         elif op == "AND":
@@ -99,17 +315,17 @@ class CPU:
 
         # Shift the value in registerA left by the number of bits specified in registerB, filling the low bits with 0.
         elif op == "SHL":
-            self.reg[reg_a] <<= self.reg[reg_b]
+            self.reg[reg_a] = (self.reg[reg_a] << self.reg[reg_b]) & 0xFF
 
         # Shift the value in registerA right by the number of bits specified in registerB, filling the high bits with 0.
         elif op == "SHR":
-            self.reg[reg_a] <<= self.reg[reg_b]
+            self.reg[reg_a] >>= self.reg[reg_b]
 
         # Divide the value in the first register by the value in the second, storing the remainder of the result in registerA.
         # If the value in the second register is 0, the system should print an error message and halt.
         elif op == "MOD":
             if self.reg[reg_b] == 0:
-                print("A system error occurred! Division by zero. Program stopped!")
+                print(f"A system error occurred! Division by zero at {self.where()}. Program stopped!")
                 self.running = False
             else:
                 self.reg[reg_a] %= self.reg[reg_b]
@@ -129,6 +345,144 @@ class CPU:
         else:
             raise Exception("Unsupported ALU operation")
 
+    def interrupt_enabled(self, n):
+        """Is interrupt n unmasked in the IM register?"""
+        return self.reg[IM] >> n & 1
+
+    def raise_interrupt(self, n):
+        """Set interrupt n's bit in the IS register."""
+        self.reg[IS] |= 1 << n
+        self.interrupts_raised += 1
+
+    def push(self, value):
+        self.sp -= 1
+        if self.sp < self.stack_low:
+            self.stack_low = self.sp
+        self.ram_write(value, self.sp)
+
+    def pop(self):
+        value = self.ram_read(self.sp)
+        self.sp += 1
+        return value
+
+    def check_interrupts(self):
+        """Jump to the handler of the lowest pending unmasked interrupt."""
+        masked_interrupts = self.reg[IM] & self.reg[IS]
+
+        if not (self.interrupts_enabled and masked_interrupts):
+            return
+
+        for i in range(8):
+            if masked_interrupts >> i & 1:
+                self.interrupts_enabled = False
+                self.reg[IS] &= ~(1 << i) & 0xFF
+                self.interrupts_serviced += 1
+
+                self.push(self.pc)
+                self.push(self.flag)
+                for r in range(7):
+                    self.push(self.reg[r])
+
+                self.pc = self.ram_read(VECTOR_TABLE + i)
+                self.cycles += INTERRUPT_CYCLES
+                break
+
+    def is_idle_loop(self, target):
+        """
+        Is the jump at PC to target a spin loop that can only be left by an
+        interrupt? That is a jump to itself, or a short backward loop of
+        instructions that have no side effects.
+        """
+        if target == self.pc:
+            return True
+
+        if not 0 < self.pc - target <= IDLE_LOOP_MAX:
+            return False
+
+        key = (target, self.pc)
+
+        if key not in self.idle_loops:
+            addr = target
+            while addr < self.pc and self.ram[addr] in IDEMPOTENT:
+                addr += 1 + (self.ram[addr] >> 6)
+
+            self.idle_loops[key] = addr == self.pc
+
+        return self.idle_loops[key]
+
+    def cycles_per_second(self):
+        """Emulated speed so far, not counting time spent asleep."""
+        if self.throttle is not None:
+            return self.throttle.hz
+
+        busy = time.monotonic() - self.start_time - self.idle_time
+        executed = self.cycles - self.idle_cycles
+        return executed / busy if busy > 0 else 0
+
+    def idle(self):
+        """
+        Sleep until a device has an interrupt for us, then fast-forward the
+        cycle counter by the cycles the spin loop would have taken.
+        """
+        # a program waiting for interrupts can go a long time between polls,
+        # so give the hooks a turn now, with the machine state settled
+        self.tick()
+
+        rate = self.cycles_per_second()
+        slept = self.devices.wait(self)
+
+        skipped = int(slept * rate)
+
+        if self.io_log is not None:
+            # depends on the wall clock, so it is logged, and replaced by
+            # the logged count on replay
+            skipped = self.io_log.idled(self, skipped)
+
+        self.idle_time += slept
+        self.idle_cycles += skipped
+        self.cycles += skipped
+        self.check_interrupts()
+
+    def tick(self):
+        """
+        Give the throttle, metrics exporter and shared state their periodic
+        turn. Called by run() at every device poll, and by idle().
+        """
+        if self.throttle is not None:
+            self.throttle.tick(self)
+
+        if self.exporter is not None:
+            self.exporter.tick(self)
+
+        if self.shared_state is not None:
+            self.shared_state.tick(self)
+
+    def metrics(self):
+        """Counters for monitoring a running CPU, as a dict."""
+        elapsed = time.monotonic() - self.start_time if self.start_time else 0
+
+        return {
+            "instructions": self.instructions,
+            "instructions_per_second":
+                self.instructions / elapsed if elapsed else 0,
+            "cycles": self.cycles,
+            "interrupts_raised": self.interrupts_raised,
+            "interrupts_serviced": self.interrupts_serviced,
+            "stack_high_water": 0xF4 - self.stack_low,
+            "output_bytes": self.output_bytes,
+            "uptime_seconds": elapsed,
+        }
+
+    def where(self, pc=None):
+        """The source location of pc (default the PC), or its address."""
+        if pc is None:
+            pc = self.pc
+
+        if self.debug_info is not None:
+            return self.debug_info.describe(pc)
+
+        return "0x%02X" % pc
+
     def trace(self):
         """
         Handy function to print out the CPU state. You might want to call this
@@ -147,42 +501,64 @@ class CPU:
         for i in range(8):
             print(" %02X" % self.reg[i], end='')
 
+        if self.debug_info is not None:
+            print(" |", self.where(), end='')
+
         print()
 
-    def run(self):
-        """Run the CPU."""
-        HLT = 0b00000001
-        LDI = 0b10000010
-        PRN = 0b01000111
-        MUL = 0b10100010
-        ADD = 0b10100000
-        SUB = 0b10100001
-        DIV = 0b10100011
-        PUSH = 0b01000101
-        POP = 0b01000110
-        CALL = 0b01010000
-        RET = 0b00010001
-        CMP = 0b10100111
-        JMP = 0b01010100
-        JEQ = 0b01010101
-        JNE = 0b01010110
-        ST = 0b10000100
-        PRA = 0b01001000
-        IRET = 0b00010011
-        AND = 0b10101000
-        OR = 0b10101010
-        XOR = 0b10101011
-        NOT = 0b01101001
-        SHL = 0b10101100
-        SHR = 0b10101101
-        MOD = 0b10100100
+    def run(self, max_instructions=None):
+        """
+        Run the CPU until it halts, or until it has executed max_instructions
+        instructions if that is given.
+        """
+        observers = self.observers
+        # instruction fetch reads RAM directly; ram_read()/ram_write() are
+        # left for data accesses so they can be instrumented
+        ram = self.ram
+        devices = self.devices
+        alu_tables = self.alu_tables
+        cmp_table = self.cmp_table
+        costs = CYCLE_COSTS
+        # opcodes of the extensions that are switched off
+        disabled = {op for name, ops in EXTENSIONS.items()
+                    if name not in self.extensions for op in ops}
+        cycles = 0  # cycles not yet added to self.cycles
+        poll = self.poll_countdown or self.poll_interval
+        window = poll  # instructions in this poll window, for counting
+
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+
+        if self.throttle is not None:
+            self.throttle.start(self)
+
+        if self.shared_state is not None:
+            # show the loaded program straight away
+            self.shared_state.publish(self)
 
         while self.running:
-            ir = self.ram_read(self.pc)
-            op_a = self.ram_read(self.pc + 1)  # address
-            op_b = self.ram_read(self.pc + 2)  # value
+            if max_instructions is not None:
+                if max_instructions == 0:
+                    break
+                max_instructions -= 1
+
+            ir = ram[self.pc]
+            op_a = ram[self.pc + 1]  # address
+            op_b = ram[self.pc + 2]  # value
+
+            if observers:
+                for observer in observers:
+                    observer.step(self, ir, op_a, op_b)
+
+            # Table-driven ALU: a single lookup instead of alu(). Division
+            # by zero still goes through alu() for its error message.
+            if alu_tables is not None and ir in alu_tables and \
+                    (ir != MOD or self.reg[op_b]):
+                reg = self.reg
+                reg[op_a] = alu_tables[ir][reg[op_a] << 8 | reg[op_b]]
+                self.pc += 3
 
-            if ir == HLT:  # halt, stop the program
+            elif ir == HLT:  # halt, stop the program
                 self.running = False
                 self.pc = 0
 
@@ -193,7 +569,9 @@ class CPU:
 
             # Print numeric value stored in the given register
             elif ir == PRN:  # register pseudo-instruction
-                print(self.reg[op_a])
+                text = str(self.reg[op_a])
+                print(text)
+                self.output_bytes += len(text) + 1
                 self.pc += 2
 
             elif ir == MUL:
@@ -234,6 +612,8 @@ class CPU:
             # Push the value in the given register on the stack.
             elif ir == PUSH:
                 self.sp -= 1  # Decrement the self.SP
+                if self.sp < self.stack_low:
+                    self.stack_low = self.sp
                 # Copy the value in the given register to the address pointed to by self.SP.
                 self.ram_write(self.reg[op_a], self.sp)
                 self.pc += 2
@@ -242,7 +622,6 @@ class CPU:
             elif ir == POP:
                 # Copy the value from the address pointed to by self.SP to the given register.
                 value = self.ram_read(self.sp)
-                print(value)
                 self.reg[op_a] = value
                 self.sp += 1  # Increment self.SP
                 self.pc += 2
@@ -252,6 +631,8 @@ class CPU:
                 # get the value at return address (the one after subroutine_addr)
                 return_addr = self.pc+2
                 self.sp -= 1  # push it to stack
+                if self.sp < self.stack_low:
+                    self.stack_low = self.sp
                 self.ram_write(return_addr, self.sp)
                 # set the pc to the subroutine address
                 self.pc = self.reg[op_a]
@@ -259,18 +640,34 @@ class CPU:
             # Return from subroutine
             elif ir == RET:
                 # Pop the value from the top of the stack and store it in the PC.
-                self.pc = self.ram[self.sp]
+                self.pc = self.ram_read(self.sp)
                 self.sp += 1
 
             # Compare the values in two registers
             elif ir == CMP:
-                self.alu("CMP", op_a, op_b)
+                if cmp_table is not None:
+                    self.flag = cmp_table[self.reg[op_a] << 8 | self.reg[op_b]]
+                else:
+                    self.alu("CMP", op_a, op_b)
                 self.pc += 3
 
             # Jump to the address stored in the given register.
             elif ir == JMP:
-                # Set the PC to the address stored in the given register.
-                self.pc = self.reg[op_a]
+                target = self.reg[op_a]
+
+                # Spinning while waiting for an interrupt? Sleep instead.
+                if self.idle_sleep and self.interrupts_enabled and \
+                        self.reg[IM] and self.is_idle_loop(target):
+                    self.pc = target
+                    # bring the counters up to date first
+                    self.cycles += cycles
+                    cycles = 0
+                    self.instructions += window - poll
+                    window = poll
+                    self.idle()
+                else:
+                    # Set the PC to the address stored in the given register.
+                    self.pc = target
 
             # If equal flag is set (true), jump to the address stored in the given register.
             elif ir == JEQ:
@@ -286,40 +683,134 @@ class CPU:
                     self.pc += 2
             # Store value in registerB in the address stored in registerA.
             elif ir == ST:
-                print("st")
-                self.reg[op_a] = self.reg[op_b]
+                self.ram_write(self.reg[op_b], self.reg[op_a])
+                self.pc += 3
+
+            # Loads registerA with the value at the memory address stored in registerB.
+            elif ir == LD:
+                self.reg[op_a] = self.ram_read(self.reg[op_b])
+                self.pc += 3
+
+            # If the value at the address in registerA equals R0, replace it
+            # with registerB and set E. Otherwise load it into R0 and clear E.
+            elif ir == CAS:
+                if ir in disabled:
+                    self.extension_disabled(ir)
+                    continue
+
+                if self.atomic is not None:
+                    self.atomic.acquire()
+
+                addr = self.reg[op_a]
+                value = self.ram_read(addr)
+                if value == self.reg[0]:
+                    self.ram_write(self.reg[op_b], addr)
+                    self.flag = flagE
+                else:
+                    self.reg[0] = value
+                    self.flag = 0
+
+                if self.atomic is not None:
+                    self.atomic.release()
                 self.pc += 3
+
+            # Load registerB with the value at the address in registerA and
+            # set that address to 1.
+            elif ir == TAS:
+                if ir in disabled:
+                    self.extension_disabled(ir)
+                    continue
+
+                if self.atomic is not None:
+                    self.atomic.acquire()
+
+                addr = self.reg[op_a]
+                self.reg[op_b] = self.ram_read(addr)
+                self.ram_write(1, addr)
+
+                if self.atomic is not None:
+                    self.atomic.release()
+                self.pc += 3
+            # Copy registerC bytes from the address in registerB to the
+            # address in registerA.
+            elif ir == MEMCPY:
+                if ir in disabled:
+                    self.extension_disabled(ir)
+                    continue
+
+                reg = self.reg
+                n = self.mem_copy(reg[op_a], reg[op_b], reg[ram[self.pc + 3]])
+                cycles += n // BULK_BYTES_PER_CYCLE
+                self.pc += 4
+
+            # Set registerC bytes at the address in registerA to registerB.
+            elif ir == MEMSET:
+                if ir in disabled:
+                    self.extension_disabled(ir)
+                    continue
+
+                reg = self.reg
+                n = self.mem_set(reg[op_a], reg[op_b], reg[ram[self.pc + 3]])
+                cycles += n // BULK_BYTES_PER_CYCLE
+                self.pc += 4
+
+            # Print registerB bytes at the address in registerA as
+            # characters.
+            elif ir == PRS:
+                if ir in disabled:
+                    self.extension_disabled(ir)
+                    continue
+
+                n = self.print_block(self.reg[op_a], self.reg[op_b])
+                cycles += n // BULK_BYTES_PER_CYCLE
+                self.pc += 3
+
             # Print alpha character value stored in the given register.
             elif ir == PRA:
                 # Print to the console the ASCII character corresponding to the value in the register.
-                print(self.reg[op_b])
+                print(chr(self.reg[op_a]), end='', flush=True)
+                self.output_bytes += 1
+                self.pc += 2
 
             # Return from an interrupt handler.
             elif ir == IRET:
                 # Registers R6-R0 are popped off the stack in that order.
                 for i in range(6, -1, -1):
-                    reg_value = self.ram_read(self.reg[i])
-                    self.reg[op_a] = reg_value
-                    self.sp += 1
-                    self.pc += 1
+                    self.reg[i] = self.pop()
 
                 # The FL register is popped off the stack.
-                fl_value = self.ram_read(self.flag)
-                self.reg[op_a] = fl_value
-                self.sp += 1
-                self.pc += 1
+                self.flag = self.pop()
 
                 # The return address is popped off the stack and stored in PC.
-                pc_value = self.ram_read(self.pc)
-                self.reg[op_a] = pc_value
-                self.sp += 1
-                self.pc += 1
-                # Interrupts are re-enabled
+                self.pc = self.pop()
 
-        number_of_operands = ir >> 6
+                # Interrupts are re-enabled
+                self.interrupts_enabled = True
+                self.check_interrupts()
 
-        # bit shift and mask to isolate the 'C' bit
-        sets_pc_directly = ((ir >> 4) & 0b001) == 0b001
+            elif ir == NOP:
+                self.pc += 1
 
-        if not sets_pc_directly:
-            self.pc += (1 + number_of_operands)
+            cycles += costs[ir]
+            poll -= 1
+            if poll == 0:
+                self.cycles += cycles
+                cycles = 0
+                self.instructions += window
+                poll = window = self.poll_interval
+                devices.poll(self)
+                self.check_interrupts()
+                self.tick()
+
+        self.cycles += cycles
+        self.instructions += window - poll
+        self.poll_countdown = poll
+
+        if self.throttle is not None:
+            self.throttle.finish(self)
+
+        if self.exporter is not None:
+            self.exporter.write(self)
+
+        if self.shared_state is not None:
+            self.shared_state.publish(self)
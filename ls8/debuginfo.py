@@ -0,0 +1,84 @@
+"""Debug info written by the assembler, for mapping PCs back to source.
+
+The assembler writes call.dbg next to call.ls8: the source file name,
+[start, end, line] address ranges and the labels. Ranges from .include'd
+files have a fourth element, an index into a list of files. Loading it builds
+flat 256-entry arrays so looking up a PC is a single index:
+
+    >>> info = DebugInfo.for_program("examples/call.ls8")
+    >>> info.describe(25)
+    'call.asm:33 (Mult2Print)'
+"""
+
+import os
+
+
+class DebugInfo:
+    def __init__(self, source, lines, symbols, size=256, files=None):
+        self.source = source
+        self.symbols = symbols  # label -> address
+        self.files = files or [source]
+
+        # source file and line number of the instruction or data at each
+        # address
+        self.file_at = [None] * size
+        self.line_at = [None] * size
+        for start, end, line, *index in lines:
+            file = self.files[index[0] if index else 0]
+            for addr in range(start, min(end, size)):
+                self.file_at[addr] = file
+                self.line_at[addr] = line
+
+        # closest label at or before each address, i.e. the subroutine
+        # it's in
+        self.label_at = [None] * size
+        label = None
+        labels = {addr: name for name, addr in symbols.items()}
+        for addr in range(size):
+            label = labels.get(addr, label)
+            self.label_at[addr] = label
+
+    @classmethod
+    def load(cls, filename):
+        # json is slow to import and most runs have no debug info, so only
+        # pay for it here
+        import json
+
+        with open(filename) as f:
+            info = json.load(f)
+
+        return cls(info["source"], info["lines"], info["symbols"],
+                   files=info.get("files"))
+
+    @classmethod
+    def for_program(cls, program):
+        """The debug info for an .ls8 file, or None if there isn't any."""
+        filename = os.path.splitext(program)[0] + ".dbg"
+
+        if not os.path.exists(filename):
+            return None
+
+        return cls.load(filename)
+
+    def address_labels(self):
+        """address -> label, for profilers and the like."""
+        return {addr: name for name, addr in self.symbols.items()}
+
+    def position(self, pc):
+        """`call.asm:33`, or None if we don't know."""
+        if not 0 <= pc < len(self.line_at) or self.line_at[pc] is None:
+            return None
+
+        return f"{self.file_at[pc]}:{self.line_at[pc]}"
+
+    def describe(self, pc):
+        """`call.asm:33 (Mult2Print)`, or as much of that as we know."""
+        text = self.position(pc)
+
+        if text is None:
+            return "0x%02X" % pc
+
+        if self.label_at[pc] is not None:
+            text += f" ({self.label_at[pc]})"
+
+        return text
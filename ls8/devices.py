@@ -0,0 +1,137 @@
+"""LS-8 peripherals: the timer and the keyboard.
+
+The CPU calls poll() every few hundred instructions to let the devices raise
+interrupts, and wait() when it detects that the program is idling in a spin
+loop, so it can sleep instead of burning a core.
+"""
+
+import atexit
+import os
+import select
+import sys
+import time
+
+TIMER_INTERRUPT = 0  # I0, fires once per second
+KEYBOARD_INTERRUPT = 1  # I1, fires when a key is pressed
+KEY_ADDR = 0xF4  # most recent key pressed is stored here
+
+
+class Devices:
+    """Real-time timer and keyboard (stdin)."""
+
+    def __init__(self, timer_period=1.0, keyboard=None):
+        self.timer_period = timer_period  # seconds between timer interrupts
+        self.next_timer = None  # monotonic deadline of the next timer tick
+
+        if keyboard is None:
+            keyboard = sys.stdin
+        self.keyboard = keyboard
+        self.raw_mode = False  # have we put the terminal into cbreak mode
+
+    def _start(self):
+        if self.next_timer is None:
+            self.next_timer = time.monotonic() + self.timer_period
+
+    def _keyboard_ready(self, cpu):
+        return self.keyboard is not None and \
+            cpu.interrupt_enabled(KEYBOARD_INTERRUPT)
+
+    def _enable_raw_mode(self):
+        """Deliver keys one at a time rather than a line at a time."""
+        self.raw_mode = True
+
+        if not self.keyboard.isatty():
+            return
+
+        import termios
+        import tty
+
+        fd = self.keyboard.fileno()
+        old = termios.tcgetattr(fd)
+        tty.setcbreak(fd)
+        atexit.register(termios.tcsetattr, fd, termios.TCSADRAIN, old)
+
+    def _read_key(self, timeout):
+        """Return the next key byte, or None if there isn't one in time."""
+        if not self.raw_mode:
+            self._enable_raw_mode()
+
+        fd = self.keyboard.fileno()
+        readable, _, _ = select.select([fd], [], [], timeout)
+
+        if not readable:
+            return None
+
+        key = os.read(fd, 1)
+
+        if key == b"":
+            # end of input, stop listening
+            self.keyboard = None
+            return None
+
+        return key[0]
+
+    def key_pressed(self, cpu, key):
+        cpu.ram_write(key, KEY_ADDR)
+        cpu.raise_interrupt(KEYBOARD_INTERRUPT)
+
+    def timer_fired(self, cpu):
+        cpu.raise_interrupt(TIMER_INTERRUPT)
+
+    def poll(self, cpu):
+        """Raise any interrupts that are due. Never blocks."""
+        self._start()
+        now = time.monotonic()
+
+        if now >= self.next_timer:
+            # ticks we were too busy to deliver are dropped, like a real
+            # timer would
+            while self.next_timer <= now:
+                self.next_timer += self.timer_period
+            self.timer_fired(cpu)
+
+        if self._keyboard_ready(cpu):
+            key = self._read_key(0)
+
+            if key is not None:
+                self.key_pressed(cpu, key)
+
+    def wait(self, cpu):
+        """
+        Block until the next timer tick or key press the CPU can take, then
+        raise it. Returns the number of seconds spent waiting.
+        """
+        self._start()
+        start = time.monotonic()
+
+        if cpu.interrupt_enabled(TIMER_INTERRUPT):
+            timeout = max(0, self.next_timer - start)
+        else:
+            # nothing will wake us on time, but don't spin either
+            timeout = self.timer_period
+
+        if self._keyboard_ready(cpu):
+            if not self.raw_mode:
+                self._enable_raw_mode()
+
+            # poll() below reads the key
+            select.select([self.keyboard.fileno()], [], [], timeout)
+        else:
+            time.sleep(timeout)
+
+        self.poll(cpu)
+
+        return time.monotonic() - start
+
+
+class QuietDevices:
+    """
+    No timer, no keyboard: for re-executing history and other runs that
+    must be deterministic.
+    """
+
+    def poll(self, cpu):
+        pass
+
+    def wait(self, cpu):
+        return 0
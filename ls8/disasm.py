@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""Disassembler for .ls8 programs.
+
+Uses the opcode table from the assembler, so it knows every instruction the
+assembler does. If the program has debug info, labels and source lines are
+shown too.
+
+Usage:
+
+    python3 disasm.py program.ls8
+"""
+
+import os
+import sys
+
+from cpu import CPU
+
+ASM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "asm")
+
+
+def import_assembler():
+    """The asm module from ../asm."""
+    if ASM_DIR not in sys.path:
+        sys.path.insert(0, ASM_DIR)
+
+    import asm
+
+    return asm
+
+
+def mnemonics():
+    """opcode -> (name, assembler operand type)"""
+    asm = import_assembler()
+
+    return {int(info["code"], 2): (name, info["type"])
+            for name, info in asm.OPCODES.items()}
+
+
+def disassemble(ram, size, debug_info=None):
+    """Yield one line of disassembly per instruction or unknown byte."""
+    table = mnemonics()
+    labels = debug_info.address_labels() if debug_info is not None else {}
+
+    addr = 0
+
+    while addr < size:
+        if addr in labels:
+            yield f"{labels[addr]}:"
+
+        ir = ram[addr]
+
+        if ir in table:
+            name, op_type = table[ir]
+            operands = ram[addr + 1:addr + 1 + (ir >> 6)]
+
+            if op_type == 8:
+                # LDI r,immediate
+                text = f"{name} R{operands[0]},{operands[1]}"
+            elif operands:
+                text = f"{name} " + ",".join(f"R{r}" for r in operands)
+            else:
+                text = name
+
+            length = 1 + len(operands)
+        else:
+            text = f"DB 0x{ir:02X}"
+            length = 1
+
+        raw = " ".join(f"{b:02X}" for b in ram[addr:addr + length])
+        line = f"    {addr:02X}: {raw:<11} {text}"
+
+        where = debug_info.position(addr) if debug_info is not None else None
+
+        if where is not None:
+            line = f"{line:<38}; {where}"
+
+        yield line
+        addr += length
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(f"usage: {argv[0]} program.ls8", file=sys.stderr)
+        return 1
+
+    cpu = CPU()
+    size = cpu.load(argv[1])
+
+    if size == 0:
+        # load() has already said so if the file is missing
+        if os.path.exists(argv[1]):
+            print(f"{argv[1]}: no program in it", file=sys.stderr)
+        return 1
+
+    for line in disassemble(cpu.ram, size, cpu.debug_info):
+        print(line)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
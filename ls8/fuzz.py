@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+
+"""Differential fuzzer for CPU engines.
+
+Generates random programs from the assembler's opcode table, with random
+registers, flags and background RAM, runs each one under the reference
+engine (a plain CPU.run()) and under candidate engines, and compares the
+final RAM, registers, PC, SP, flags, cycle and instruction counts and
+output. Every program comes from its own seed, so any program can be
+regenerated from its number alone. When a candidate diverges, the program
+is shrunk to a small reproducer and printed.
+
+Jumps and calls are always preceded by an LDI of the address of one of the
+program's instructions, so control flow stays inside the program unless
+RET or IRET pops something else off the stack.
+
+Engines are functions engine(cpu, limit) that run a prepared CPU for at
+most `limit` instructions. The built-in ones are listed in ENGINES; others
+can be given as module:function.
+
+Usage:
+
+    python3 fuzz.py [engine ...] [-n programs] [-j workers] [--limit N]
+    python3 fuzz.py [engine ...] --seed N
+
+With no engines, every candidate in ENGINES is checked. --seed checks,
+shrinks and shows a single program.
+"""
+
+import contextlib
+import importlib
+import io
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+from cpu import CPU, LDI, HLT, flagL, flagG, flagE
+from devices import QuietDevices
+
+# Instructions per program run, so infinite loops end
+LIMIT = 2000
+
+# Random instructions per program, not counting the LDIs that load jump
+# targets and the final HLT. Keeps programs below the stack.
+MAX_LENGTH = 32
+
+# Where the stack starts; everything below may be code
+STACK = 0xF4
+
+# Programs per pool task
+BATCH = 250
+
+# Instructions per run() call for the sliced engine
+SLICE = 7
+
+# State that isn't comparable when run() raises
+COUNTERS = ("cycles", "instructions")
+
+# Register and immediate values are picked from these half the time, since
+# bugs cluster at the edges
+INTERESTING = (0, 1, 2, 3, 4, 5, 7, 8, 9, 15, 16, 31, 32, 63, 64, 127, 128,
+               129, 254, 255)
+
+
+def reference(cpu, limit):
+    cpu.run(limit)
+
+
+_tables = None
+
+
+def tables(cpu, limit):
+    """Table-driven ALU, see alu_tables.py."""
+    global _tables
+
+    if _tables is None:
+        import alu_tables
+        _tables = alu_tables.load()
+
+    cpu.alu_tables, cpu.cmp_table = _tables
+    cpu.run(limit)
+
+
+def sliced(cpu, limit):
+    """Many short run() calls, as multicore.Machine does."""
+    while cpu.running and limit > 0:
+        before = cpu.instructions
+        cpu.run(min(SLICE, limit))
+        limit -= cpu.instructions - before
+
+
+ENGINES = {
+    "reference": reference,
+    "tables": tables,
+    "sliced": sliced,
+}
+
+
+def get_engine(name):
+    """An engine by name, or by module:function."""
+    if name in ENGINES:
+        return ENGINES[name]
+
+    if ":" not in name:
+        raise ValueError(f"unknown engine {name}")
+
+    module, function = name.split(":", 1)
+
+    return getattr(importlib.import_module(module), function)
+
+
+def implemented(opcode):
+    """
+    Does the reference CPU implement this opcode? Unknown opcodes leave the
+    machine exactly as it was, stuck at the same PC.
+    """
+    cpu = CPU()
+    cpu.devices = QuietDevices()
+    cpu.ram[0] = opcode
+    cpu.reg[:7] = [0x40] * 7
+    before = (list(cpu.ram), list(cpu.reg), cpu.sp, cpu.flag)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu.run(1)
+
+    return cpu.pc != 0 or not cpu.running or \
+        (cpu.ram, cpu.reg, cpu.sp, cpu.flag) != before
+
+
+def instruction_set(all_opcodes=False):
+    """
+    Opcodes from the assembler's table, except HLT (every program ends with
+    one) and, unless all_opcodes, those the reference doesn't implement.
+    """
+    from disasm import mnemonics
+
+    return sorted(op for op in mnemonics()
+                  if op != HLT and (all_opcodes or implemented(op)))
+
+
+class Program:
+    """
+    A generated program and the machine state it starts from.
+
+    instructions are [opcode, operand a, operand b, operand c, target]
+    lists, using as many operands as the opcode has. target is None, or for
+    the LDIs that load jump addresses the index of the instruction whose
+    address operand b should be; layout() fills it in.
+    """
+
+    def __init__(self, instructions, reg, flag, background):
+        self.instructions = instructions
+        self.reg = reg
+        self.flag = flag
+        self.background = background  # RAM contents around the program
+
+    @classmethod
+    def generate(cls, seed, isa, max_length=MAX_LENGTH):
+        rng = random.Random(seed)
+        instructions = []
+
+        def value():
+            if rng.random() < 0.5:
+                return rng.choice(INTERESTING)
+            return rng.randrange(256)
+
+        for _ in range(rng.randint(1, max_length)):
+            op = rng.choice(isa)
+            r = rng.randrange(8)
+
+            # Instructions that set the PC from a register get a target
+            if op & 0b00010000 and op >> 6 == 1:
+                instructions.append([LDI, r, 0, 0, True])
+                instructions.append([op, r, 0, 0, None])
+            elif op == LDI:
+                instructions.append([LDI, r, value(), 0, None])
+            else:
+                instructions.append([op, r, rng.randrange(8),
+                                     rng.randrange(8), None])
+
+        instructions.append([HLT, 0, 0, 0, None])
+
+        for instruction in instructions:
+            if instruction[4] is not None:
+                instruction[4] = rng.randrange(len(instructions))
+
+        reg = [value() for _ in range(7)] + [STACK]
+        flag = rng.choice((0, flagL, flagG, flagE))
+        background = list(rng.randbytes(256))
+
+        return cls(instructions, reg, flag, background)
+
+    def layout(self):
+        """(RAM image, program size in bytes)"""
+        addrs = []
+        addr = 0
+
+        for op, *_ in self.instructions:
+            addrs.append(addr)
+            addr += 1 + (op >> 6)
+
+        ram = list(self.background)
+
+        for (op, a, b, c, target), addr in zip(self.instructions, addrs):
+            if target is not None:
+                b = addrs[target] if target < len(addrs) else addr
+
+            ram[addr:addr + 1 + (op >> 6)] = [op, a, b, c][:1 + (op >> 6)]
+
+        return ram, addr
+
+    def without(self, start, end):
+        """A copy with instructions[start:end] removed."""
+        removed = end - start
+        instructions = []
+
+        for op, a, b, c, target in self.instructions[:start] + \
+                self.instructions[end:]:
+            if target is not None:
+                if target >= end:
+                    target -= removed
+                elif target >= start:
+                    target = start
+
+            instructions.append([op, a, b, c, target])
+
+        return Program(instructions, self.reg, self.flag, self.background)
+
+    def copy(self, **changes):
+        program = Program([list(i) for i in self.instructions],
+                          list(self.reg), self.flag, list(self.background))
+        program.__dict__.update(changes)
+        return program
+
+
+def execute(program, engine, limit=LIMIT):
+    """Run a program under an engine and return its final state as a dict."""
+    cpu = CPU()
+    cpu.devices = QuietDevices()
+    cpu.idle_sleep = False
+    cpu.ram[:], _ = program.layout()
+    cpu.reg[:] = program.reg
+    cpu.flag = program.flag
+
+    output = io.StringIO()
+    error = None
+
+    try:
+        with contextlib.redirect_stdout(output):
+            engine(cpu, limit)
+    except Exception as e:
+        # e.g. fetching operands past the end of RAM; the engines should
+        # agree on that too
+        error = type(e).__name__
+
+    return {
+        "ram": list(cpu.ram),
+        "reg": list(cpu.reg),
+        "pc": cpu.pc,
+        "sp": cpu.sp,
+        "flag": cpu.flag,
+        "running": cpu.running,
+        "interrupts_enabled": cpu.interrupts_enabled,
+        "cycles": cpu.cycles,
+        "instructions": cpu.instructions,
+        "output": output.getvalue(),
+        "error": error,
+    }
+
+
+def compare(program, engines, limit=LIMIT):
+    """
+    Run a program under the reference and each candidate. Returns
+    {engine name: (reference state, candidate state, [differing fields])}
+    for the candidates that diverged.
+    """
+    expected = execute(program, reference, limit)
+    divergences = {}
+
+    for name in engines:
+        actual = execute(program, get_engine(name), limit)
+        fields = [k for k in expected if expected[k] != actual[k]]
+
+        # run() only brings the counters up to date when it returns
+        if expected["error"] is not None and \
+                expected["error"] == actual["error"]:
+            fields = [k for k in fields if k not in COUNTERS]
+
+        if fields:
+            divergences[name] = (expected, actual, fields)
+
+    return divergences
+
+
+# The instruction set, built once per worker process
+_isa = None
+
+
+def check_batch(args):
+    """
+    Pool task: check the programs for seeds [start, start + count). Returns
+    (seed, {engine: differing fields}) for each divergent one.
+    """
+    global _isa
+
+    engines, start, count, limit, all_opcodes = args
+
+    if _isa is None:
+        _isa = instruction_set(all_opcodes)
+
+    found = []
+
+    for seed in range(start, start + count):
+        divergences = compare(Program.generate(seed, _isa), engines, limit)
+
+        if divergences:
+            found.append((seed, {name: fields for name, (_, _, fields)
+                                 in divergences.items()}))
+
+    return found
+
+
+def minimize(program, engines, limit=LIMIT):
+    """
+    Shrink a divergent program while it still diverges: drop runs of
+    instructions, halving the run length down to one, then zero the
+    registers, operands and background RAM.
+    """
+    def diverges(candidate):
+        return bool(compare(candidate, engines, limit))
+
+    chunk = max(1, len(program.instructions) // 2)
+
+    while chunk >= 1:
+        i = 0
+
+        while i < len(program.instructions):
+            candidate = program.without(i, i + chunk)
+
+            if diverges(candidate):
+                program = candidate
+            else:
+                i += chunk
+
+        chunk //= 2
+
+    for r in range(8):
+        if program.reg[r]:
+            reg = list(program.reg)
+            reg[r] = 0
+            candidate = program.copy(reg=reg)
+
+            if diverges(candidate):
+                program = candidate
+
+    if program.flag:
+        candidate = program.copy(flag=0)
+
+        if diverges(candidate):
+            program = candidate
+
+    for i, (op, a, b, c, target) in enumerate(program.instructions):
+        if op == LDI and target is None and b:
+            candidate = program.copy()
+            candidate.instructions[i][2] = 0
+
+            if diverges(candidate):
+                program = candidate
+
+    chunk = len(program.background)
+
+    while chunk >= 1:
+        for i in range(0, len(program.background), chunk):
+            if any(program.background[i:i + chunk]):
+                background = list(program.background)
+                background[i:i + chunk] = [0] * len(background[i:i + chunk])
+                candidate = program.copy(background=background)
+
+                if diverges(candidate):
+                    program = candidate
+
+        chunk //= 2
+
+    return program
+
+
+def report(seed, program, engines, limit=LIMIT, f=sys.stdout):
+    """Print a reproducer: the program, its start state and the differences."""
+    from disasm import disassemble
+
+    ram, size = program.layout()
+
+    # Background bytes past the program can be code too, once shrinking has
+    # removed the instructions before them
+    code_end = max([size] + [addr + 1 for addr in range(STACK)
+                             if ram[addr]])
+
+    print(f"program {seed}:", file=f)
+
+    for line in disassemble(ram, code_end):
+        print(line, file=f)
+
+    print(f"registers {' '.join('%02X' % r for r in program.reg)}, "
+          f"flag {program.flag:03b}", file=f)
+
+    data = [(addr, value) for addr, value in enumerate(ram)
+            if value and addr >= code_end]
+    if data:
+        print("data " + " ".join("%02X:%02X" % d for d in data), file=f)
+
+    for name, (expected, actual, fields) in \
+            compare(program, engines, limit).items():
+        print(f"{name} diverges from reference:", file=f)
+
+        for field in fields:
+            if field == "ram":
+                expected_value = {a: v for a, v in enumerate(expected["ram"])
+                                  if v != actual["ram"][a]}
+                actual_value = {a: actual["ram"][a] for a in expected_value}
+            else:
+                expected_value, actual_value = expected[field], actual[field]
+
+            print(f"  {field}: reference {expected_value!r}, "
+                  f"{name} {actual_value!r}", file=f)
+
+
+def fuzz(engines, programs, workers=None, limit=LIMIT, all_opcodes=False,
+         f=sys.stdout):
+    """Check `programs` programs, shrink and report the first divergence."""
+    start = time.perf_counter()
+    tasks = [(engines, first, min(BATCH, programs - first), limit,
+              all_opcodes)
+             for first in range(0, programs, BATCH)]
+
+    found = []
+
+    with Pool(workers) as pool:
+        for batch in pool.imap_unordered(check_batch, tasks):
+            found.extend(batch)
+
+    elapsed = time.perf_counter() - start
+
+    print(f"{programs} programs against {', '.join(engines)} in "
+          f"{elapsed:.1f}s ({60 * programs / elapsed:.0f} programs/min), "
+          f"{len(found)} divergent", file=f)
+
+    if not found:
+        return 0
+
+    found.sort()
+
+    for seed, fields in found[:10]:
+        print(f"  program {seed}: " + "; ".join(
+            f"{name} {', '.join(names)}" for name, names in fields.items()),
+            file=f)
+
+    seed = found[0][0]
+    isa = instruction_set(all_opcodes)
+    small = minimize(Program.generate(seed, isa), engines, limit)
+    report(seed, small, engines, limit, f)
+
+    return 1
+
+
+def main(argv):
+    args = argv[1:]
+    programs = 10000
+    workers = None
+    limit = LIMIT
+    seed = None
+    all_opcodes = False
+    engines = []
+
+    try:
+        while args:
+            arg = args.pop(0)
+
+            if arg == "-n":
+                programs = int(args.pop(0))
+            elif arg == "-j":
+                workers = int(args.pop(0))
+            elif arg == "--limit":
+                limit = int(args.pop(0))
+            elif arg == "--seed":
+                seed = int(args.pop(0))
+            elif arg == "--all-opcodes":
+                all_opcodes = True
+            else:
+                get_engine(arg)
+                engines.append(arg)
+
+    except (IndexError, ValueError, ImportError, AttributeError) as e:
+        print(f"{e or 'missing value'}\n{__doc__}", file=sys.stderr)
+        return 1
+
+    if not engines:
+        engines = [name for name in ENGINES if name != "reference"]
+
+    if seed is not None:
+        program = Program.generate(seed, instruction_set(all_opcodes))
+
+        if not compare(program, engines, limit):
+            print(f"program {seed}: no divergence")
+            return 0
+
+        report(seed, minimize(program, engines, limit), engines, limit)
+        return 1
+
+    return fuzz(engines, programs, workers or os.cpu_count(), limit,
+                all_opcodes)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+"""Instruction coverage and RAM access heatmaps for the LS-8.
+
+Three counters per address, kept in compact typed arrays:
+
+* executed: times an instruction at this address was executed
+* reads:    data reads (POP, RET, LD, ...), not instruction fetches
+* writes:   data writes (PUSH, CALL, ST, ...)
+
+Counters can be saved to a file and merged, so nightly runs (or the
+processes of a batch run) can accumulate into one set of totals.
+
+Usage:
+
+    python3 instrument.py program.ls8 [counters.bin [heatmap.html]]
+
+If counters.bin already exists the new counts are added to it.
+"""
+
+import os
+import sys
+from array import array
+from multiprocessing import Pool
+
+from cpu import CPU
+
+RAM_SIZE = 256
+
+# ASCII shades for the heatmap, coldest first
+SHADES = " .:-=+*#%@"
+
+
+def _counters():
+    return array("Q", bytes(8 * RAM_SIZE))
+
+
+class Coverage:
+    """Execution and RAM access counters for one or more runs."""
+
+    def __init__(self):
+        self.executed = _counters()
+        self.reads = _counters()
+        self.writes = _counters()
+
+    def attach(self, cpu):
+        """
+        Start counting on a CPU. Exec counts come from the observer hook;
+        RAM accesses are counted by wrapping this CPU's ram_read/ram_write.
+        """
+        ram = cpu.ram
+        reads = self.reads
+        writes = self.writes
+
+        def ram_read(mar):
+            reads[mar] += 1
+            return ram[mar]
+
+        def ram_write(mdr, mar):
+            writes[mar] += 1
+            ram[mar] = mdr
+
+        cpu.ram_read = ram_read
+        cpu.ram_write = ram_write
+        cpu.observers.append(self)
+
+    def step(self, cpu, ir, op_a, op_b):
+        """Called by CPU.run() before each instruction."""
+        self.executed[cpu.pc] += 1
+
+    def merge(self, other):
+        """Add another Coverage's counts into this one."""
+        for mine, theirs in ((self.executed, other.executed),
+                             (self.reads, other.reads),
+                             (self.writes, other.writes)):
+            for addr in range(RAM_SIZE):
+                mine[addr] += theirs[addr]
+
+    def tobytes(self):
+        return (self.executed.tobytes() + self.reads.tobytes() +
+                self.writes.tobytes())
+
+    @classmethod
+    def frombytes(cls, data):
+        coverage = cls()
+        size = 8 * RAM_SIZE
+
+        coverage.executed = array("Q", data[:size])
+        coverage.reads = array("Q", data[size:2 * size])
+        coverage.writes = array("Q", data[2 * size:3 * size])
+
+        return coverage
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            f.write(self.tobytes())
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            return cls.frombytes(f.read())
+
+    def accesses(self):
+        """Reads plus writes per address."""
+        return [r + w for r, w in zip(self.reads, self.writes)]
+
+    def heatmap(self, counts=None):
+        """
+        Render a 16x16 ASCII heatmap of the address space. Rows are the high
+        nibble of the address, columns the low nibble.
+        """
+        if counts is None:
+            counts = self.accesses()
+
+        hottest = max(counts) or 1
+        lines = ["    " + "".join("%X" % col for col in range(16))]
+
+        for row in range(16):
+            cells = []
+
+            for col in range(16):
+                count = counts[row * 16 + col]
+
+                if count == 0:
+                    cells.append(SHADES[0])
+                else:
+                    # anything touched gets at least the first visible shade
+                    shade = 1 + (len(SHADES) - 2) * count // hottest
+                    cells.append(SHADES[shade])
+
+            lines.append("%X0  %s" % (row, "".join(cells)))
+
+        return "\n".join(lines)
+
+    def heatmap_html(self, counts=None):
+        """Same as heatmap(), as an HTML table with hover counts."""
+        if counts is None:
+            counts = self.accesses()
+
+        hottest = max(counts) or 1
+        rows = []
+
+        for row in range(16):
+            cells = []
+
+            for col in range(16):
+                addr = row * 16 + col
+                count = counts[addr]
+                heat = int(255 * count / hottest)
+                cells.append(
+                    f'<td title="0x{addr:02X}: {count}" '
+                    f'style="background: rgb(255, {255 - heat}, {255 - heat})">'
+                    f'{addr:02X}</td>')
+
+            rows.append(f"<tr>{''.join(cells)}</tr>")
+
+        return ("<table style=\"font-family: monospace\">\n" +
+                "\n".join(rows) + "\n</table>\n")
+
+    def listing(self, filename):
+        """
+        Annotate an .ls8 file gcov-style: instructions are prefixed with how
+        many times they ran, or ##### if never. Data bytes show reads/writes.
+        """
+        lines = []
+        addr = 0
+
+        with open(filename) as f:
+            for line in f:
+                line = line.rstrip("\n")
+                code, _, comment = line.partition("#")
+
+                if code.strip() == "":
+                    lines.append(f"{'':>10}       {line}")
+                    continue
+
+                executed = self.executed[addr]
+                accessed = self.reads[addr] + self.writes[addr]
+
+                # the assembler comments instruction bytes with their
+                # mnemonic
+                if executed:
+                    count = str(executed)
+                elif comment.strip():
+                    count = "#####"
+                else:
+                    count = ""
+
+                data = f"r{self.reads[addr]}/w{self.writes[addr]}" \
+                    if accessed else ""
+                lines.append(f"{count:>10} {addr:02X} {data:>10} {line}")
+
+                addr += 1
+
+        return "\n".join(lines)
+
+
+def run_instrumented(filename):
+    """Run a program once with counters attached, return the counters."""
+    coverage = Coverage()
+
+    cpu = CPU()
+    coverage.attach(cpu)
+    cpu.load(filename)
+    cpu.run()
+
+    return coverage
+
+
+def _run_worker(filename):
+    return run_instrumented(filename).tobytes()
+
+
+def run_batch(filenames, processes=None):
+    """
+    Run each program in a process pool and merge all the counters. Counters
+    cross the process boundary as raw bytes.
+    """
+    total = Coverage()
+
+    with Pool(processes) as pool:
+        for data in pool.imap_unordered(_run_worker, filenames):
+            total.merge(Coverage.frombytes(data))
+
+    return total
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(f"usage: {argv[0]} program.ls8 [counters.bin [heatmap.html]]",
+              file=sys.stderr)
+        return 1
+
+    coverage = run_instrumented(argv[1])
+
+    if len(argv) > 2:
+        if os.path.exists(argv[2]):
+            coverage.merge(Coverage.load(argv[2]))
+
+        coverage.save(argv[2])
+
+    if len(argv) > 3:
+        with open(argv[3], "w") as f:
+            f.write(coverage.heatmap_html())
+
+    print(coverage.listing(argv[1]))
+    print("\nexecuted:")
+    print(coverage.heatmap(coverage.executed))
+    print("\nRAM reads + writes:")
+    print(coverage.heatmap())
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
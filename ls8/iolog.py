@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+
+"""Record and replay the device events of an interactive LS-8 session.
+
+Everything the LS-8 does is determined by its program, except what the
+devices bring in: key presses, timer ticks, and how many cycles an idle loop
+is fast-forwarded by while the CPU sleeps (see CPU.idle()). A Recorder logs
+just those, each with the cycle count at which it happened. A Replayer feeds
+them back at the same cycle counts, so a session that took minutes at the
+keyboard re-runs at full interpreter speed, with no real time passing, and
+can be benchmarked or checked for regressions. At the end of a replay the
+machine state and a checksum of the output are compared with the recording.
+
+Devices only act at polls (every cpu.poll_interval instructions) and when the
+CPU waits in an idle loop, and the cycle count strictly increases between
+waits, so a cycle count plus whether the CPU was waiting pins down exactly
+where an event goes.
+
+File layout, integers little-endian:
+
+    header  "LS8R" version flags poll_interval program_crc32
+    event   varint (cycles since the last event << 3 | kind), followed by
+            the key byte for a key press, or a varint of the cycles skipped
+            for an idle wait  (repeated)
+    end     varint 0, then the final state (see FINAL)
+
+Kinds are TIMER, KEY and IDLE, with WAITING added to timer ticks and key
+presses that arrived while the CPU was waiting. Flags bit 0 is idle_sleep.
+
+Usage:
+
+    python3 iolog.py record program.ls8 session.log
+    python3 iolog.py replay program.ls8 session.log
+    python3 iolog.py dump session.log
+
+record runs the program with the real timer and keyboard until it halts or
+is stopped with Ctrl-C. replay runs it again from the log and exits with
+status 2 if it diverged.
+"""
+
+import os
+import signal
+import struct
+import sys
+import time
+import zlib
+
+from cpu import CPU
+from devices import KEY_ADDR, KEYBOARD_INTERRUPT, TIMER_INTERRUPT
+
+MAGIC = b"LS8R"
+VERSION = 1
+
+HEADER = struct.Struct("<4sBBII")
+# instructions, cycles, interrupts raised, interrupts serviced, output
+# bytes, output CRC-32, PC, SP, FL, halted, interrupts enabled, R0-R7, RAM
+FINAL = struct.Struct("<5QI5B8B256s")
+
+END = 0
+TIMER = 1
+KEY = 2
+IDLE = 3
+WAITING = 4
+
+KIND_NAMES = {TIMER: "timer", KEY: "key", IDLE: "idle"}
+
+
+class ReplayError(Exception):
+    pass
+
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data, pos):
+    """Returns the value and the position after it."""
+    n = shift = 0
+
+    while True:
+        if pos >= len(data):
+            raise ReplayError("truncated log")
+
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        shift += 7
+
+        if b < 0x80:
+            return n, pos
+
+
+class OutputChecksum:
+    """Stands in for sys.stdout, keeping a CRC-32 of everything written."""
+
+    def __init__(self, stream):
+        self.stream = stream  # where to pass output on to, or None
+        self.crc = 0
+
+    def write(self, text):
+        self.crc = zlib.crc32(text.encode(), self.crc)
+
+        if self.stream is not None:
+            self.stream.write(text)
+
+        return len(text)
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+
+def program_crc(cpu):
+    return zlib.crc32(bytes(v & 0xFF for v in cpu.ram))
+
+
+def final_state(cpu, output_crc, halted):
+    return FINAL.pack(cpu.instructions, cpu.cycles, cpu.interrupts_raised,
+                      cpu.interrupts_serviced, cpu.output_bytes, output_crc,
+                      cpu.pc & 0xFF, cpu.sp & 0xFF, cpu.flag & 0xFF, halted,
+                      cpu.interrupts_enabled, *(r & 0xFF for r in cpu.reg),
+                      bytes(v & 0xFF for v in cpu.ram))
+
+
+def describe_state(data):
+    """The fields of a packed FINAL state, as a dict."""
+    values = FINAL.unpack(data)
+
+    state = dict(zip(("instructions", "cycles", "interrupts_raised",
+                      "interrupts_serviced", "output_bytes", "output_crc",
+                      "pc", "sp", "flag", "halted", "interrupts_enabled"),
+                     values))
+    state["reg"] = list(values[11:19])
+    state["ram"] = values[19]
+
+    return state
+
+
+class Recorder:
+    """Logs the device events of a run to a file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.log = bytearray()
+        self.last_cycle = 0
+        self.waiting = 0  # WAITING while inside devices.wait()
+        self.events = 0
+        self.stopped = False
+
+    def attach(self, cpu):
+        """Hook the CPU's current devices; keep them, just listen in."""
+        cpu.io_log = self
+        devices = cpu.devices
+
+        key_pressed = devices.key_pressed
+        timer_fired = devices.timer_fired
+        wait = devices.wait
+
+        def logged_key_pressed(cpu, key):
+            self.event(cpu, KEY | self.waiting)
+            self.log.append(key)
+            key_pressed(cpu, key)
+
+        def logged_timer_fired(cpu):
+            self.event(cpu, TIMER | self.waiting)
+            timer_fired(cpu)
+
+        def logged_wait(cpu):
+            self.waiting = WAITING
+            try:
+                return wait(cpu)
+            finally:
+                self.waiting = 0
+
+        devices.key_pressed = logged_key_pressed
+        devices.timer_fired = logged_timer_fired
+        devices.wait = logged_wait
+
+    def event(self, cpu, kind):
+        write_varint(self.log, (cpu.cycles - self.last_cycle) << 3 | kind)
+        self.last_cycle = cpu.cycles
+        self.events += 1
+
+    def idled(self, cpu, skipped):
+        """Called by CPU.idle() with the cycles it is about to skip."""
+        self.event(cpu, IDLE)
+        write_varint(self.log, skipped)
+        return skipped
+
+    def stop(self, signum, frame):
+        """SIGINT handler: end the recording at the next instruction."""
+        self.stopped = True
+        self.cpu.running = False
+
+    def run(self, cpu):
+        """
+        Run the CPU until it halts or Ctrl-C is pressed, then write the log.
+        """
+        self.cpu = cpu
+        header = HEADER.pack(MAGIC, VERSION, cpu.idle_sleep,
+                             cpu.poll_interval, program_crc(cpu))
+        output = OutputChecksum(sys.stdout)
+        handler = signal.signal(signal.SIGINT, self.stop)
+        stdout, sys.stdout = sys.stdout, output
+
+        try:
+            cpu.run()
+        finally:
+            sys.stdout = stdout
+            signal.signal(signal.SIGINT, handler)
+
+        write_varint(self.log, END)
+
+        with open(self.filename, "wb") as f:
+            f.write(header)
+            f.write(self.log)
+            f.write(final_state(cpu, output.crc, not self.stopped))
+
+
+class Replayer:
+    """Stands in for the devices, feeding them a recorded log."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            data = f.read()
+
+        if len(data) < HEADER.size:
+            raise ReplayError(f"{filename}: not an LS-8 event log")
+
+        magic, version, flags, self.poll_interval, self.program_crc = \
+            HEADER.unpack_from(data)
+
+        if magic != MAGIC or version != VERSION:
+            raise ReplayError(f"{filename}: not an LS-8 event log")
+
+        self.idle_sleep = bool(flags & 1)
+        self.events = []  # (cycle, kind, key byte or cycles skipped)
+        self.next = 0  # index of the next event to deliver
+
+        pos = HEADER.size
+        cycle = 0
+
+        while True:
+            n, pos = read_varint(data, pos)
+            kind = n & 7
+
+            if kind == END:
+                break
+
+            cycle += n >> 3
+            value = None
+
+            if kind & ~WAITING == KEY:
+                value = data[pos]
+                pos += 1
+            elif kind == IDLE:
+                value, pos = read_varint(data, pos)
+
+            self.events.append((cycle, kind, value))
+
+        if len(data) - pos != FINAL.size:
+            raise ReplayError(f"{filename}: truncated log")
+
+        self.final = describe_state(data[pos:])
+
+    def attach(self, cpu):
+        cpu.devices = self
+        cpu.io_log = self
+        cpu.poll_interval = self.poll_interval
+        cpu.idle_sleep = self.idle_sleep
+
+    def deliver(self, cpu, waiting):
+        """Raise the interrupts logged at this cycle count."""
+        events = self.events
+
+        while self.next < len(events):
+            cycle, kind, value = events[self.next]
+
+            if cycle < cpu.cycles:
+                raise ReplayError(f"{KIND_NAMES[kind & ~WAITING]} event "
+                                  f"logged at cycle {cycle} was missed, "
+                                  f"the CPU is at cycle {cpu.cycles}")
+
+            if cycle > cpu.cycles or kind == IDLE or \
+                    kind & WAITING != waiting:
+                return
+
+            if kind & ~WAITING == KEY:
+                cpu.ram_write(value, KEY_ADDR)
+                cpu.raise_interrupt(KEYBOARD_INTERRUPT)
+            else:
+                cpu.raise_interrupt(TIMER_INTERRUPT)
+
+            self.next += 1
+
+    def poll(self, cpu):
+        self.deliver(cpu, 0)
+
+    def wait(self, cpu):
+        """No sleeping: the logged wake-up comes straight away."""
+        self.deliver(cpu, WAITING)
+        return 0
+
+    def idled(self, cpu, skipped):
+        """Called by CPU.idle(); returns the cycles skipped when recording."""
+        if self.next < len(self.events):
+            cycle, kind, value = self.events[self.next]
+
+            if kind == IDLE and cycle == cpu.cycles:
+                self.next += 1
+                return value
+
+        raise ReplayError(f"the CPU went idle at cycle {cpu.cycles}, but "
+                          f"it didn't when recording")
+
+    def run(self, cpu, stream=None):
+        """
+        Replay the whole log, passing output on to stream. Returns a list of
+        differences from the recording, empty if there were none.
+        """
+        if program_crc(cpu) != self.program_crc:
+            raise ReplayError("the log was recorded with a different program")
+
+        output = OutputChecksum(stream)
+        stdout, sys.stdout = sys.stdout, output
+
+        try:
+            cpu.run(self.final["instructions"] - cpu.instructions)
+        finally:
+            sys.stdout = stdout
+
+        if self.next < len(self.events):
+            cycle, kind, _ = self.events[self.next]
+            raise ReplayError(f"{len(self.events) - self.next} events from "
+                              f"cycle {cycle} on were never delivered")
+
+        replayed = describe_state(final_state(cpu, output.crc,
+                                              not cpu.running))
+
+        return [f"{field}: recorded {self.final[field]}, replayed {value}"
+                for field, value in replayed.items()
+                if field != "ram" and value != self.final[field]] + \
+               [f"RAM {addr:02X}: recorded {self.final['ram'][addr]:02X}, "
+                f"replayed {value:02X}"
+                for addr, value in enumerate(replayed["ram"])
+                if value != self.final["ram"][addr]]
+
+
+def no_program(cpu, program):
+    """Load program, and say so if there's nothing to run."""
+    if cpu.load(program):
+        return False
+
+    # load() has already said so if the file is missing
+    if os.path.exists(program):
+        print(f"{program}: no program in it", file=sys.stderr)
+
+    return True
+
+
+def record(program, filename):
+    """Returns the number of events logged, or None with no program."""
+    recorder = Recorder(filename)
+
+    cpu = CPU()
+    recorder.attach(cpu)
+
+    if no_program(cpu, program):
+        return None
+
+    recorder.run(cpu)
+
+    return recorder.events
+
+
+def replay(program, filename, stream=sys.stdout):
+    """
+    Returns the Replayer, the CPU, and the differences found, or None with
+    no program.
+    """
+    replayer = Replayer(filename)
+
+    cpu = CPU()
+    replayer.attach(cpu)
+
+    if no_program(cpu, program):
+        return None
+
+    return replayer, cpu, replayer.run(cpu, stream)
+
+
+def dump(filename, f=sys.stdout):
+    replayer = Replayer(filename)
+
+    for cycle, kind, value in replayer.events:
+        name = KIND_NAMES[kind & ~WAITING]
+
+        if kind & ~WAITING == KEY:
+            name += f" {value:02X}"
+        elif kind == IDLE:
+            name += f" +{value}"
+
+        if kind & WAITING:
+            name += " (waiting)"
+
+        f.write(f"{cycle:>12} {name}\n")
+
+    state = replayer.final
+    f.write(f"{'halted' if state['halted'] else 'stopped'} after "
+            f"{state['instructions']} instructions, {state['cycles']} "
+            f"cycles, {state['output_bytes']} bytes of output\n")
+
+
+def main(argv):
+    if len(argv) == 4 and argv[1] == "record":
+        events = record(argv[2], argv[3])
+
+        if events is None:
+            return 1
+
+        print(f"\n{events} events logged", file=sys.stderr)
+
+    elif len(argv) == 4 and argv[1] == "replay":
+        start = time.perf_counter()
+
+        try:
+            replayed = replay(argv[2], argv[3])
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+        except ReplayError as e:
+            print(f"\nreplay diverged: {e}", file=sys.stderr)
+            return 2
+
+        if replayed is None:
+            return 1
+
+        replayer, cpu, differences = replayed
+
+        elapsed = time.perf_counter() - start
+
+        for line in differences:
+            print(line, file=sys.stderr)
+
+        print(f"\n{len(replayer.events)} events, {cpu.instructions} "
+              f"instructions replayed in {elapsed:.3f}s: "
+              f"{'differs' if differences else 'matches'}", file=sys.stderr)
+
+        return 2 if differences else 0
+
+    elif len(argv) == 3 and argv[1] == "dump":
+        try:
+            dump(argv[2])
+        except (OSError, ReplayError) as e:
+            print(e, file=sys.stderr)
+            return 1
+
+    else:
+        print(f"usage: {argv[0]} record program.ls8 session.log\n"
+              f"       {argv[0]} replay program.ls8 session.log\n"
+              f"       {argv[0]} dump session.log", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
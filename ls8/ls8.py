@@ -1,11 +1,275 @@
 #!/usr/bin/env python3
 
-"""Main."""
+"""Main.
+
+    ls8.py program.ls8                      same as `ls8.py run program.ls8`
+    ls8.py run program.ls8 [options]        run a program
+        --hz N          throttle to N Hz, see throttle.py
+        --tables        use the table-driven ALU, see alu_tables.py
+        --metrics FILE  export metrics to FILE, see metrics.py
+        --shared NAME   publish live state in shared memory segment NAME,
+                        see sharedstate.py
+        --record FILE   log key presses and timer ticks to FILE until the
+                        program halts or Ctrl-C, see iolog.py
+        --strict        run only the LS-8 spec, no ISA extensions
+        -x EXT[,EXT]    run only these ISA extensions, see cpu.py
+    ls8.py replay program.ls8 FILE          re-run a recorded session at
+                                            full speed and check it matches
+    ls8.py asm [options] source.asm [out.ls8]
+                                            assemble, see ../asm/asm.py
+    ls8.py disasm program.ls8               disassemble, see disasm.py
+    ls8.py bench program.ls8 [runs] [--tables]
+                                            time repeated runs
+    ls8.py profile program.ls8 [out.folded] call-graph profile, see
+                                            profiler.py
+    ls8.py fuzz [engine ...] [-n programs]  check engines against the
+                                            reference, see fuzz.py
+    ls8.py monitor NAME [hz]                watch a run started with
+                                            --shared NAME, see monitor.py
+
+This is launched a lot from scripts, so each command imports only what it
+needs: `run` without options loads nothing but cpu.py and its devices.
+"""
 
 import sys
-from cpu import *
 
-cpu = CPU()
 
-cpu.load()
-cpu.run()
\ No newline at end of file
+def pop_option(args, name, has_value=True):
+    """Remove `name` (and its value) from args. Returns the value, True if it
+    takes no value, or None if it isn't there."""
+    if name not in args:
+        return None
+
+    i = args.index(name)
+
+    if not has_value:
+        del args[i]
+        return True
+
+    if i + 1 >= len(args):
+        print(f"{name} needs a value", file=sys.stderr)
+        sys.exit(1)
+
+    value = args[i + 1]
+    del args[i:i + 2]
+
+    return value
+
+
+def usage():
+    print(__doc__, file=sys.stderr)
+    return 1
+
+
+def load(cpu, filename):
+    """
+    Load a program into cpu. Returns False, having said why, if there's
+    nothing to run: CPU.load() reports a missing file but carries on.
+    """
+    if cpu.load(filename):
+        return True
+
+    import os
+
+    if os.path.exists(filename):
+        print(f"{filename}: no program in it", file=sys.stderr)
+
+    return False
+
+
+def run(args):
+    hz = pop_option(args, "--hz")
+    tables = pop_option(args, "--tables", False)
+    metrics = pop_option(args, "--metrics")
+    shared = pop_option(args, "--shared")
+    record = pop_option(args, "--record")
+    strict = pop_option(args, "--strict", False)
+    extensions = pop_option(args, "-x")
+
+    if len(args) != 1 or (strict and extensions is not None):
+        return usage()
+
+    from cpu import CPU, EXTENSIONS
+
+    cpu = CPU()
+
+    if strict:
+        cpu.extensions = set()
+
+    if extensions is not None:
+        cpu.extensions = set(extensions.split(","))
+        unknown = cpu.extensions - set(EXTENSIONS)
+        if unknown:
+            print(f"-x takes a list of extensions: {', '.join(EXTENSIONS)}",
+                  file=sys.stderr)
+            return 1
+
+    if hz is not None:
+        from throttle import Throttle
+        try:
+            Throttle(float(hz)).attach(cpu)
+        except ValueError as e:
+            print(f"--hz: {e}", file=sys.stderr)
+            return 1
+
+    if tables:
+        import alu_tables
+        alu_tables.enable(cpu)
+
+    if metrics is not None:
+        from metrics import MetricsExporter
+        MetricsExporter(metrics).attach(cpu)
+
+    if shared is not None:
+        from sharedstate import SharedState
+        SharedState(shared).attach(cpu)
+
+    if record is not None:
+        from iolog import Recorder
+        recorder = Recorder(record)
+        recorder.attach(cpu)
+
+    if not load(cpu, args[0]):
+        if shared is not None:
+            cpu.shared_state.close()
+        return 1
+
+    try:
+        if record is not None:
+            recorder.run(cpu)
+        else:
+            cpu.run()
+    except KeyboardInterrupt:
+        # Ctrl-C skips the exporter's final write at the end of run()
+        if metrics is not None:
+            cpu.exporter.write(cpu)
+    finally:
+        if shared is not None:
+            cpu.shared_state.close()
+
+    if hz is not None:
+        cpu.throttle.report(cpu)
+
+    return 0
+
+
+def assemble(args):
+    from disasm import import_assembler
+
+    asm = import_assembler()
+
+    return asm.main(["asm.py"] + args)
+
+
+def disassemble(args):
+    import disasm
+
+    return disasm.main(["disasm.py"] + args)
+
+
+def bench(args):
+    tables = pop_option(args, "--tables", False)
+
+    if not 1 <= len(args) <= 2:
+        return usage()
+
+    import contextlib
+    import io
+    import time
+
+    from cpu import CPU
+    from devices import QuietDevices
+
+    runs = int(args[1]) if len(args) > 1 else 100
+
+    # before stdout is redirected, so the reason gets through
+    if not load(CPU(), args[0]):
+        return 1
+
+    if tables:
+        import alu_tables
+        tables = alu_tables.load()
+
+    instructions = 0
+    start = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(runs):
+            cpu = CPU()
+            cpu.devices = QuietDevices()
+            if tables:
+                cpu.alu_tables, cpu.cmp_table = tables
+
+            cpu.load(args[0])
+            # programs that never halt are cut off
+            cpu.run(10_000_000)
+            instructions += cpu.instructions
+
+    elapsed = time.perf_counter() - start
+
+    print(f"{runs} runs, {instructions} instructions in {elapsed:.3f}s: "
+          f"{instructions / elapsed:.0f} instructions/s, "
+          f"{1000 * elapsed / runs:.3f} ms/run")
+
+    return 0
+
+
+def profile(args):
+    from cpu import CPU
+
+    if args and not load(CPU(), args[0]):
+        return 1
+
+    import profiler
+
+    return profiler.main(["profiler.py"] + args)
+
+
+def fuzz(args):
+    import fuzz
+
+    return fuzz.main(["fuzz.py"] + args)
+
+
+def replay(args):
+    from cpu import CPU
+
+    if args and not load(CPU(), args[0]):
+        return 1
+
+    import iolog
+
+    return iolog.main(["iolog.py", "replay"] + args)
+
+
+def monitor(args):
+    import monitor
+
+    return monitor.main(["monitor.py"] + args)
+
+
+COMMANDS = {
+    "run": run,
+    "asm": assemble,
+    "disasm": disassemble,
+    "bench": bench,
+    "profile": profile,
+    "fuzz": fuzz,
+    "monitor": monitor,
+    "replay": replay,
+}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] in ("-h", "--help"):
+        return usage()
+
+    if argv[1] in COMMANDS:
+        return COMMANDS[argv[1]](argv[2:])
+
+    # plain `ls8.py program.ls8`
+    return run(argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
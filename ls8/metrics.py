@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""Periodically export an LS-8's runtime metrics to a file.
+
+The file is rewritten in place (atomically) every few seconds, as JSON or,
+if its name ends in .prom, in the Prometheus text exposition format so the
+node exporter's textfile collector can pick it up. The same numbers are
+available in-process from CPU.metrics().
+
+Usage:
+
+    python3 metrics.py program.ls8 metrics.json [seconds]
+"""
+
+import json
+import os
+import sys
+import time
+
+from cpu import CPU
+
+# Prometheus metric types for CPU.metrics() keys; the rest are gauges
+COUNTERS = {"instructions", "cycles", "interrupts_raised",
+            "interrupts_serviced", "output_bytes"}
+
+
+def prometheus_text(metrics):
+    """Render a metrics dict in the Prometheus text exposition format."""
+    lines = []
+
+    for name, value in metrics.items():
+        if name in COUNTERS:
+            lines.append(f"# TYPE ls8_{name}_total counter")
+            lines.append(f"ls8_{name}_total {value}")
+        else:
+            lines.append(f"# TYPE ls8_{name} gauge")
+            lines.append(f"ls8_{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Writes CPU.metrics() to a file every `interval` seconds."""
+
+    def __init__(self, filename, interval=5.0):
+        self.filename = filename
+        self.interval = interval
+        self.next_write = 0  # monotonic time of the next write
+
+    def attach(self, cpu):
+        cpu.exporter = self
+        # the file exists from the start, not only after the first interval
+        self.write(cpu)
+
+    def tick(self, cpu):
+        """Called by CPU.tick() at polls and before idle waits."""
+        if time.monotonic() >= self.next_write:
+            self.write(cpu)
+
+    def write(self, cpu):
+        metrics = cpu.metrics()
+
+        if self.filename.endswith(".prom"):
+            text = prometheus_text(metrics)
+        else:
+            text = json.dumps(metrics, indent=2) + "\n"
+
+        # readers never see a half written file
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.filename)
+
+        self.next_write = time.monotonic() + self.interval
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(f"usage: {argv[0]} program.ls8 metrics.json [seconds]",
+              file=sys.stderr)
+        return 1
+
+    interval = float(argv[3]) if len(argv) > 3 else 5.0
+
+    cpu = CPU()
+    exporter = MetricsExporter(argv[2], interval)
+    exporter.attach(cpu)
+    cpu.load(argv[1])
+
+    try:
+        cpu.run()
+    except KeyboardInterrupt:
+        exporter.write(cpu)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
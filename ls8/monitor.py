@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""Terminal monitor for a running LS-8.
+
+Attaches to the shared memory segment of a CPU started with
+`ls8.py run program.ls8 --shared NAME` (see sharedstate.py) and redraws its
+registers, counters, instruction rate and a 16x16 map of RAM a few times a
+second. The PC is shown in reverse video, SP underlined, and bytes that
+changed since the last frame in bold. The CPU never waits for the monitor.
+
+Usage:
+
+    python3 monitor.py NAME [refreshes per second]
+    python3 monitor.py NAME --once
+
+--once prints the current state as plain text and exits. q quits.
+"""
+
+import sys
+import time
+
+import sharedstate
+
+
+def flags_text(flag):
+    return "".join(name if flag & bit else "-"
+                   for name, bit in (("L", 4), ("G", 2), ("E", 1)))
+
+
+def rate_text(rate):
+    if rate >= 1e6:
+        return f"{rate / 1e6:.2f}M/s"
+    if rate >= 1e3:
+        return f"{rate / 1e3:.1f}K/s"
+    return f"{rate:.0f}/s"
+
+
+def status_lines(state, rate):
+    """The header lines, as plain text."""
+    return [
+        f"{'running' if state['running'] else 'halted':<8} "
+        f"PC {state['pc']:02X}  SP {state['sp']:02X}  "
+        f"FL {flags_text(state['flag'])}  "
+        f"interrupts {'on' if state['interrupts_enabled'] else 'off'}",
+        "  ".join(f"R{i} {r:02X}" for i, r in enumerate(state["reg"])),
+        f"instructions {state['instructions']} ({rate_text(rate)})  "
+        f"cycles {state['cycles']}  "
+        f"interrupts {state['interrupts_serviced']}/"
+        f"{state['interrupts_raised']}  output {state['output_bytes']} B",
+    ]
+
+
+def memory_lines(ram):
+    """The RAM map, as plain text."""
+    lines = ["    " + " ".join(f" {col:X}" for col in range(16))]
+
+    for row in range(0, len(ram), 16):
+        lines.append(f"{row:02X}: " + " ".join(
+            f"{b:02X}" for b in ram[row:row + 16]))
+
+    return lines
+
+
+def instruction_rate(previous, state):
+    """Instructions per second between two snapshots."""
+    if previous is None:
+        return 0
+
+    elapsed = (state["time_ns"] - previous["time_ns"]) / 1e9
+
+    if elapsed <= 0:
+        return 0
+
+    return (state["instructions"] - previous["instructions"]) / elapsed
+
+
+def print_once(buf):
+    state = sharedstate.read(buf)
+
+    if state is None:
+        print("segment busy, try again", file=sys.stderr)
+        return 1
+
+    for line in status_lines(state, 0) + [""] + memory_lines(state["ram"]):
+        print(line)
+
+    return 0
+
+
+def monitor(screen, buf, name, hz):
+    import curses
+
+    curses.curs_set(0)
+    screen.nodelay(True)
+
+    previous = None
+    rate = 0
+    changed = set()
+
+    while screen.getch() not in (ord("q"), ord("Q")):
+        state = sharedstate.read(buf)
+
+        if state is not None:
+            # keep the last rate while the CPU is between updates
+            if previous is not None and \
+                    state["sequence"] != previous["sequence"]:
+                rate = instruction_rate(previous, state)
+                changed = {a for a in range(len(state["ram"]))
+                           if state["ram"][a] != previous["ram"][a]}
+
+            if previous is None or state["sequence"] != previous["sequence"]:
+                previous = state
+
+            draw(screen, curses, state, name, rate, changed)
+
+        time.sleep(1 / hz)
+
+
+def draw(screen, curses, state, name, rate, changed):
+    screen.erase()
+    height, width = screen.getmaxyx()
+
+    lines = [f"LS-8 {name}   q to quit"] + status_lines(state, rate) + [""]
+
+    for y, line in enumerate(lines[:height]):
+        screen.addnstr(y, 0, line, width - 1)
+
+    y0 = len(lines)
+    header = memory_lines(state["ram"])[0]
+
+    if y0 < height:
+        screen.addnstr(y0, 0, header, width - 1)
+
+    for row in range(16):
+        y = y0 + 1 + row
+
+        if y >= height:
+            break
+
+        screen.addnstr(y, 0, f"{row * 16:02X}:", width - 1)
+
+        for col in range(16):
+            addr = row * 16 + col
+            x = 4 + 3 * col
+
+            if x + 2 >= width:
+                break
+
+            attr = curses.A_NORMAL
+            if addr == state["pc"]:
+                attr |= curses.A_REVERSE
+            if addr == state["sp"]:
+                attr |= curses.A_UNDERLINE
+            if addr in changed:
+                attr |= curses.A_BOLD
+
+            screen.addstr(y, x, f"{state['ram'][addr]:02X}", attr)
+
+    screen.refresh()
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__, file=sys.stderr)
+        return 1
+
+    try:
+        shm = sharedstate.attach(argv[1])
+    except (FileNotFoundError, ValueError) as e:
+        print(f"can't attach to {argv[1]}: {e}", file=sys.stderr)
+        return 1
+
+    try:
+        if "--once" in argv:
+            return print_once(shm.buf)
+
+        import curses
+
+        hz = float(argv[2]) if len(argv) > 2 else 10
+        curses.wrapper(monitor, shm.buf, argv[1], hz)
+
+    finally:
+        shm.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
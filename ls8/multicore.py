@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""Multi-core LS-8: several CPU cores sharing one RAM.
+
+Every core is an ordinary CPU with its own registers, PC and flags, whose
+`ram` is the machine's RAM. All cores start at address 0 with their core
+number in R0, and each gets its own stack region below the previous core's:
+
+    core 0: F3 and down, core 1: F3 - stack_size and down, ...
+
+Two ways to run:
+
+* run() interleaves the cores deterministically in one process, each for a
+  fixed quantum of instructions in turn, so runs are reproducible. Devices
+  are quiet (no timer, no keyboard) for the same reason.
+
+* run_parallel() gives each core its own process over a shared_memory RAM
+  buffer. CAS and TAS take a lock shared by all the cores; plain loads and
+  stores don't. Devices are quiet here too.
+
+Programs synchronize with the CAS (compare-and-swap) and TAS (test-and-set)
+extension instructions, see cpu.py.
+
+Usage:
+
+    python3 multicore.py program.ls8 [cores] [-p]
+
+-p runs the cores in separate processes.
+"""
+
+import sys
+from multiprocessing import Lock, Process, Queue, shared_memory
+
+from cpu import CPU
+from devices import QuietDevices
+
+# Stack bytes reserved per core
+STACK_SIZE = 16
+
+
+class Machine:
+    """N cores sharing one RAM."""
+
+    def __init__(self, cores=2, quantum=100, stack_size=STACK_SIZE):
+        self.quantum = quantum  # instructions per core per turn
+        self.stack_size = stack_size
+        self.ram = [0] * 256
+        self.cores = [self.make_core(n, self.ram) for n in range(cores)]
+
+    def make_core(self, n, ram):
+        cpu = CPU()
+        cpu.ram = ram
+        cpu.devices = QuietDevices()
+        cpu.idle_sleep = False
+
+        cpu.sp = cpu.stack_low = 0xF4 - n * self.stack_size
+        cpu.reg[7] = cpu.sp
+        cpu.reg[0] = n
+
+        return cpu
+
+    def load(self, filename):
+        # any core will do, they all write into the same RAM
+        self.cores[0].load(filename)
+
+    def running(self):
+        return any(core.running for core in self.cores)
+
+    def run(self, max_rounds=None):
+        """
+        Round-robin the cores until they've all halted, or for max_rounds
+        rounds. Returns the number of rounds run.
+        """
+        rounds = 0
+
+        while self.running():
+            if max_rounds is not None and rounds == max_rounds:
+                break
+
+            for core in self.cores:
+                if core.running:
+                    core.run(self.quantum)
+
+            rounds += 1
+
+        return rounds
+
+    def run_parallel(self):
+        """Run every core in its own process until they've all halted."""
+        shm = shared_memory.SharedMemory(create=True, size=len(self.ram))
+
+        try:
+            shm.buf[:len(self.ram)] = bytes(self.ram)
+
+            lock = Lock()
+            results = Queue()
+            processes = []
+
+            for n, core in enumerate(self.cores):
+                state = (core.reg, core.pc, core.sp, core.flag)
+                p = Process(target=_core_process,
+                            args=(shm.name, n, state, lock, results))
+                p.start()
+                processes.append(p)
+
+            for _ in processes:
+                n, state = results.get()
+                core = self.cores[n]
+                core.reg, core.pc, core.sp, core.flag = state
+                core.running = False
+
+            for p in processes:
+                p.join()
+
+            self.ram[:] = shm.buf[:len(self.ram)]
+
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+def _core_process(shm_name, n, state, lock, results):
+    """Body of one core's process in run_parallel()."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    cpu = CPU()
+    # a memoryview indexes and assigns bytes as ints, just like the list
+    cpu.ram = shm.buf
+    cpu.atomic = lock
+    cpu.idle_sleep = False
+    # like run(): a real timer or keyboard would be one core's alone, and
+    # stdin belongs to the parent process
+    cpu.devices = QuietDevices()
+    reg, cpu.pc, cpu.sp, cpu.flag = state
+    cpu.reg[:] = reg
+
+    try:
+        cpu.run()
+    finally:
+        results.put((n, (cpu.reg, cpu.pc, cpu.sp, cpu.flag)))
+        del cpu
+        shm.close()
+
+
+def main(argv):
+    args = [a for a in argv[1:] if a != "-p"]
+
+    if not args:
+        print(f"usage: {argv[0]} program.ls8 [cores] [-p]", file=sys.stderr)
+        return 1
+
+    machine = Machine(int(args[1]) if len(args) > 1 else 2)
+    machine.load(args[0])
+
+    if "-p" in argv:
+        machine.run_parallel()
+    else:
+        machine.run()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
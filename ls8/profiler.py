@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""Call-graph profiler for the LS-8.
+
+Keeps a shadow call stack next to the real stack in RAM: every CALL pushes
+the subroutine address, every RET pops it. Each executed instruction's
+cycles (see cpu.CYCLE_COSTS) are charged to the current call path, so the
+totals are inclusive per caller. An interrupt pushes a frame of its own,
+I0 to I7, that IRET pops, so handlers aren't charged to whatever they
+interrupted; the cycles taken to enter the handler are charged to it too.
+Cycles skipped while asleep in an idle loop aren't charged to anything.
+
+Output is in the "collapsed stack" format understood by flamegraph.pl,
+speedscope and friends:
+
+    main;MULT2PRINT 12
+
+Usage:
+
+    python3 profiler.py program.ls8 [out.folded]
+"""
+
+import os
+import re
+import sys
+
+from cpu import CPU, CALL, INTERRUPT_CYCLES, IRET, RET, VECTOR_TABLE
+from debuginfo import DebugInfo
+
+# `# MULT2PRINT (address 24):` lines written by the assembler
+LABEL_COMMENT = re.compile(r"#\s*(\w+)\s*\(address\s+(\d+)\):")
+
+
+def load_symbols(filename):
+    """
+    Build an address -> label map for a program, from its debug info if the
+    assembler left any, otherwise from the label comments the assembler
+    writes into .ls8 files. Returns an empty map if there are none.
+    """
+
+    debug_info = DebugInfo.for_program(filename)
+
+    if debug_info is not None:
+        return debug_info.address_labels()
+
+    symbols = {}
+
+    with open(filename) as f:
+        for line in f:
+            m = LABEL_COMMENT.search(line)
+
+            if m is not None:
+                symbols[int(m.group(2))] = m.group(1)
+
+    return symbols
+
+
+class CallGraphProfiler:
+    """CPU observer that attributes cycles to call paths."""
+
+    def __init__(self, symbols=None, stack_base=0xF4):
+        self.symbols = symbols or {}
+        self.stack_base = stack_base  # where SP starts, see the spec
+
+        # shadow call stack of frame names, bottom frame is the entry point
+        self.stack = ["main"]
+        self.path = ("main",)  # tuple(self.stack), rebuilt on CALL/RET
+
+        self.samples = {}  # call path -> cycles spent there
+        self.interrupts = 0  # cpu.interrupts_serviced as of the last step
+        self.handler_depths = []  # shadow stack depth of each interrupt frame
+        self.max_depth = 1  # deepest shadow call stack seen
+        self.min_sp = stack_base  # lowest stack pointer seen
+
+    def name(self, addr):
+        """Label for a subroutine address, or its hex address."""
+        return self.symbols.get(addr, "0x%02X" % addr)
+
+    def push(self, frame):
+        self.stack.append(frame)
+        self.path = tuple(self.stack)
+
+        if len(self.stack) > self.max_depth:
+            self.max_depth = len(self.stack)
+
+    def enter_interrupt(self, cpu):
+        """An interrupt was taken just before this instruction."""
+        vectors = cpu.ram[VECTOR_TABLE:VECTOR_TABLE + 8]
+        frame = f"I{vectors.index(cpu.pc)}" if cpu.pc in vectors else "I?"
+
+        self.handler_depths.append(len(self.stack))
+        self.push(frame)
+        self.samples[self.path] = \
+            self.samples.get(self.path, 0) + INTERRUPT_CYCLES
+
+    def step(self, cpu, ir, op_a, op_b):
+        """Called by CPU.run() before each instruction."""
+        if cpu.interrupts_serviced != self.interrupts:
+            self.interrupts = cpu.interrupts_serviced
+            self.enter_interrupt(cpu)
+
+        samples = self.samples
+        path = self.path
+        samples[path] = samples.get(path, 0) + cpu.cycle_cost(ir, op_a, op_b)
+
+        if cpu.sp < self.min_sp:
+            self.min_sp = cpu.sp
+
+        if ir == CALL:
+            self.push(self.name(cpu.reg[op_a]))
+
+        # a stray RET with an empty shadow stack (or handler frame) is
+        # charged to main (or the handler)
+        elif ir == RET and len(self.stack) > \
+                (self.handler_depths[-1] + 1 if self.handler_depths else 1):
+            self.stack.pop()
+            self.path = tuple(self.stack)
+
+        # also drops any frames the handler CALLed without RETurning from
+        elif ir == IRET and self.handler_depths:
+            del self.stack[self.handler_depths.pop():]
+            self.path = tuple(self.stack)
+
+    def collapsed(self):
+        """Yield `frame;frame;frame cycles` lines, heaviest first."""
+        for path, cycles in sorted(self.samples.items(),
+                                   key=lambda item: -item[1]):
+            yield f"{';'.join(path)} {cycles}"
+
+    def write_collapsed(self, f):
+        for line in self.collapsed():
+            f.write(f"{line}\n")
+
+    def report(self, f=sys.stderr):
+        """Print inclusive cycles per subroutine and stack usage."""
+        inclusive = {}
+        total = 0
+
+        for path, cycles in self.samples.items():
+            total += cycles
+
+            # count each frame once per path, so recursion isn't double
+            # charged
+            for frame in set(path):
+                inclusive[frame] = inclusive.get(frame, 0) + cycles
+
+        print(f"{'subroutine':<20} {'cycles':>10} {'%':>6}", file=f)
+
+        for frame, cycles in sorted(inclusive.items(),
+                                    key=lambda item: -item[1]):
+            pct = 100 * cycles / total if total else 0
+            print(f"{frame:<20} {cycles:>10} {pct:>6.1f}", file=f)
+
+        print(f"max call depth: {self.max_depth}", file=f)
+        print(f"max stack depth: {self.stack_base - self.min_sp} bytes "
+              f"(lowest SP 0x{self.min_sp:02X})", file=f)
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(f"usage: {argv[0]} program.ls8 [out.folded]", file=sys.stderr)
+        return 1
+
+    cpu = CPU()
+
+    if cpu.load(argv[1]) == 0:
+        # load() has already said so if the file is missing
+        if os.path.exists(argv[1]):
+            print(f"{argv[1]}: no program in it", file=sys.stderr)
+        return 1
+
+    profiler = CallGraphProfiler(load_symbols(argv[1]))
+    cpu.observers.append(profiler)
+    cpu.run()
+
+    if len(argv) > 2:
+        with open(argv[2], "w") as f:
+            profiler.write_collapsed(f)
+
+    profiler.report()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,160 @@
+"""Live CPU state in shared memory, for monitors in other processes.
+
+A SharedState attached to a CPU copies its RAM, registers, PC and counters
+into a multiprocessing.shared_memory segment when run() starts, at device
+polls (every 256 instructions, see cpu.POLL_INTERVAL), before idle waits,
+at most once a millisecond, and when run() returns. Another process can
+attach to the segment by name and read it whenever it likes, without the
+CPU ever waiting for it; see monitor.py.
+
+The copy is what keeps this cheap: RAM itself backed by the segment (a
+memoryview, as multicore.py uses) runs the interpreter about 15% slower than
+a list, while publishing costs well under 1%.
+
+Segment layout, integers little-endian:
+
+    offset  size  field
+         0     4  magic, b"LS8S"
+         4     2  layout version, 1
+         6     2  offset of RAM, 96
+         8     8  sequence number, odd while an update is being written
+        16     8  instructions executed
+        24     8  cycles
+        32     8  time of the update, time.monotonic_ns()
+        40     8  interrupts raised
+        48     8  interrupts serviced
+        56     8  output bytes
+        64     1  PC
+        65     1  SP
+        66     1  FL
+        67     1  1 if running, 0 once halted
+        68     1  1 if interrupts are enabled
+        69     3  unused
+        72     8  R0-R7
+        80    16  unused
+        96   256  RAM
+
+Readers copy the segment and retry if the sequence number was odd or
+changed meanwhile, so they never see half an update.
+"""
+
+import struct
+import time
+from multiprocessing import shared_memory
+
+MAGIC = b"LS8S"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHH")
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+BODY = struct.Struct("<6Q5B3x8B")
+BODY_OFFSET = 16
+RAM_OFFSET = 96
+RAM_SIZE = 256
+SIZE = RAM_OFFSET + RAM_SIZE
+
+FIELDS = ("instructions", "cycles", "time_ns", "interrupts_raised",
+          "interrupts_serviced", "output_bytes", "pc", "sp", "flag",
+          "running", "interrupts_enabled")
+
+
+class SharedState:
+    """Publishes a CPU's state into a named shared memory segment."""
+
+    def __init__(self, name=None, interval=0.001):
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=SIZE)
+        self.name = self.shm.name
+        self.sequence = 0
+        self.interval = int(interval * 1e9)  # ns between updates
+        self.next_publish = 0  # monotonic ns of the next update
+
+        self.shm.buf[:SIZE] = bytes(SIZE)
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, RAM_OFFSET)
+
+    def attach(self, cpu):
+        cpu.shared_state = self
+        self.publish(cpu)
+
+    def tick(self, cpu):
+        """Called by CPU.tick() at polls and before idle waits."""
+        if time.monotonic_ns() >= self.next_publish:
+            self.publish(cpu)
+
+    def publish(self, cpu):
+        """
+        Copy the state out. Called by CPU.run() when it starts and returns.
+        """
+        now = time.monotonic_ns()
+        self.next_publish = now + self.interval
+        buf = self.shm.buf
+
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)
+
+        BODY.pack_into(buf, BODY_OFFSET, cpu.instructions, cpu.cycles,
+                       now, cpu.interrupts_raised,
+                       cpu.interrupts_serviced, cpu.output_bytes,
+                       cpu.pc & 0xFF, cpu.sp & 0xFF, cpu.flag, cpu.running,
+                       cpu.interrupts_enabled, *cpu.reg)
+
+        try:
+            buf[RAM_OFFSET:SIZE] = bytes(cpu.ram)
+        except ValueError:
+            # CALL from the top of RAM pushes a return address > 255
+            buf[RAM_OFFSET:SIZE] = bytes(v & 0xFF for v in cpu.ram)
+
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        """Remove the segment. Monitors already attached keep their view."""
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach(name):
+    """Open an existing segment for reading, without taking ownership."""
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 every attach is tracked, and the tracker would
+        # unlink the segment when the monitor exits
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+    magic, version, _ = HEADER.unpack_from(shm.buf, 0)
+
+    if magic != MAGIC or version != VERSION:
+        shm.close()
+        raise ValueError(f"{name} is not an LS-8 state segment")
+
+    return shm
+
+
+def read(buf, retries=100):
+    """
+    A consistent snapshot of the state in buf, as a dict with FIELDS, "reg"
+    and "ram" (bytes), or None if the writer kept it busy.
+    """
+    for _ in range(retries):
+        before, = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)
+
+        if before & 1:
+            continue
+
+        data = bytes(buf[:SIZE])
+        after, = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)
+
+        if before == after:
+            values = BODY.unpack_from(data, BODY_OFFSET)
+            state = dict(zip(FIELDS, values))
+            state["reg"] = list(values[len(FIELDS):])
+            state["ram"] = data[RAM_OFFSET:SIZE]
+            state["sequence"] = after
+            return state
+
+    return None
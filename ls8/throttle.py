@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""Run the LS-8 at a fixed emulated clock speed.
+
+The CPU runs flat out for a time slice's worth of cycles, then the throttle
+sleeps off whatever is left of the slice. The clock is only read once per
+slice, never per instruction. Cycle counts come from CPU.CYCLE_COSTS.
+
+Usage:
+
+    python3 throttle.py program.ls8 [hz]
+
+runs the program at hz (default 1 MHz) and reports the effective frequency
+it actually achieved.
+"""
+
+import sys
+import time
+
+from cpu import CPU, POLL_INTERVAL
+
+# Length of one time slice in seconds
+SLICE = 0.01
+
+
+class Throttle:
+    """Keeps a CPU's cycle count in step with the wall clock."""
+
+    def __init__(self, hz, slice_length=SLICE):
+        if not 0 < hz < float("inf"):
+            raise ValueError(f"clock speed must be a positive number of Hz, "
+                             f"not {hz}")
+
+        self.hz = hz
+        self.slice_cycles = max(1, int(hz * slice_length))
+
+        self.start_time = None
+        self.start_cycles = 0
+        self.next_check = 0  # cycle count at which the slice ends
+        self.slept = 0  # total seconds slept
+
+    def attach(self, cpu):
+        cpu.throttle = self
+        # check at least once per slice, even at very low speeds
+        cpu.poll_interval = max(1, min(POLL_INTERVAL, self.slice_cycles))
+
+    def start(self, cpu):
+        """Called when CPU.run() starts; the first call starts the clock."""
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+            self.start_cycles = cpu.cycles
+            self.next_check = cpu.cycles + self.slice_cycles
+
+    def sync(self, cpu):
+        """Sleep until the wall clock catches up with the cycle count."""
+        now = time.monotonic()
+        due = self.start_time + (cpu.cycles - self.start_cycles) / self.hz
+
+        if due > now:
+            time.sleep(due - now)
+            self.slept += due - now
+
+    def tick(self, cpu):
+        """Called by CPU.tick(); cheap unless a slice has ended."""
+        if cpu.cycles < self.next_check:
+            return
+
+        self.sync(cpu)
+        self.next_check = cpu.cycles + self.slice_cycles
+
+    def finish(self, cpu):
+        """Called when CPU.run() returns, so the last slice is paid for."""
+        self.sync(cpu)
+
+    def effective_hz(self, cpu):
+        elapsed = time.monotonic() - self.start_time
+        return (cpu.cycles - self.start_cycles) / elapsed if elapsed else 0
+
+    def report(self, cpu, f=sys.stderr):
+        elapsed = time.monotonic() - self.start_time
+        effective = self.effective_hz(cpu)
+        error = 100 * (effective - self.hz) / self.hz
+        busy = 100 * (elapsed - self.slept) / elapsed if elapsed else 0
+
+        print(f"target {self.hz:.0f} Hz, effective {effective:.0f} Hz "
+              f"({error:+.2f}%), {cpu.cycles - self.start_cycles} cycles "
+              f"in {elapsed:.3f}s, busy {busy:.1f}%", file=f)
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(f"usage: {argv[0]} program.ls8 [hz]", file=sys.stderr)
+        return 1
+
+    try:
+        throttle = Throttle(float(argv[2]) if len(argv) > 2 else 1e6)
+    except ValueError as e:
+        print(f"{argv[0]}: {e}", file=sys.stderr)
+        return 1
+
+    cpu = CPU()
+    throttle.attach(cpu)
+    cpu.load(argv[1])
+
+    try:
+        cpu.run()
+    except KeyboardInterrupt:
+        pass
+
+    throttle.report(cpu)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
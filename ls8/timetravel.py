@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+"""Time-travel debugging for the LS-8.
+
+While the program runs, a full snapshot of the machine is taken every
+`interval` instructions. In between only deltas are logged, in compact
+arrays: which instruction wrote which RAM address, and which registers each
+instruction changed.
+
+Going backwards means restoring the nearest snapshot at or before the
+target and re-executing forward to it, with output and devices muted. The
+history is trimmed from the oldest end to stay inside a memory budget.
+
+Re-execution is only faithful for programs that don't depend on the timer
+or keyboard.
+
+Usage:
+
+    python3 timetravel.py program.ls8
+
+runs the program until it halts or crashes, then drops into a prompt:
+
+    rs [n]      reverse step n instructions (default 1)
+    s [n]       step forward n instructions (default 1)
+    w ADDR      add a watchpoint on a RAM address (hex)
+    wr N        add a watchpoint on register RN
+    rc          reverse continue to the last write to a watched address or
+                change to a watched register
+    lw ADDR     run back to the last write of RAM address ADDR (hex)
+    lr N        run back to the last change to register RN
+    p           print the machine state
+    q           quit
+"""
+
+import contextlib
+import io
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+from cpu import CPU
+from devices import QuietDevices
+
+# Bytes of history kept by default
+BUDGET = 16 * 1024 * 1024
+
+# Rough size of one logged delta: step number plus address or register mask
+DELTA_BYTES = 9
+
+
+def save_state(cpu, instructions=None, poll_countdown=None):
+    """
+    Everything needed to put a CPU back where it was. In the middle of
+    run(), cpu.instructions and cpu.poll_countdown are only brought up to
+    date at polls, so the caller passes the real values.
+    """
+    if instructions is None:
+        instructions = cpu.instructions
+    if poll_countdown is None:
+        poll_countdown = cpu.poll_countdown
+
+    return (list(cpu.ram), list(cpu.reg), cpu.pc, cpu.sp, cpu.flag,
+            cpu.running, cpu.interrupts_enabled, cpu.cycles,
+            instructions, poll_countdown)
+
+
+def restore_state(cpu, state):
+    ram, reg, cpu.pc, cpu.sp, cpu.flag, cpu.running, \
+        cpu.interrupts_enabled, cpu.cycles, cpu.instructions, \
+        cpu.poll_countdown = state
+
+    # CPU.run() and the write logger hold on to the RAM list, so copy into
+    # it rather than replacing it
+    cpu.ram[:] = ram
+    cpu.reg[:] = reg
+
+
+class TimeTravel:
+    """CPU observer that records history and can move back through it."""
+
+    def __init__(self, interval=1000, budget=BUDGET):
+        self.interval = interval  # instructions between snapshots
+        self.budget = budget  # bytes of history to keep
+
+        self.cpu = None
+        self.position = 0  # instructions executed so far
+
+        self.snapshot_steps = []
+        self.snapshots = []
+
+        self.write_steps = array("Q")  # RAM writes: which instruction,
+        self.write_addrs = array("B")  # and which address
+        self.reg_steps = array("Q")  # register changes: which instruction,
+        self.reg_masks = array("B")  # and a bit per register it changed
+        self.last_reg = None
+        self.recording = True  # off while goto() re-executes
+
+    def attach(self, cpu):
+        self.cpu = cpu
+        self.last_reg = list(cpu.reg)
+        # the countdown carries across run() calls, so polls fall every
+        # poll_interval instructions counting from here
+        self.start_instructions = cpu.instructions
+        self.start_countdown = cpu.poll_countdown or cpu.poll_interval
+        self.snapshot_size = 8 * (len(cpu.ram) + len(cpu.reg)) + 100
+
+        ram_write = cpu.ram_write
+        write_steps = self.write_steps
+        write_addrs = self.write_addrs
+
+        def logged_ram_write(mdr, mar):
+            if self.recording:
+                # step() has already counted the instruction doing the write
+                write_steps.append(self.position - 1)
+                write_addrs.append(mar)
+            ram_write(mdr, mar)
+
+        cpu.ram_write = logged_ram_write
+        cpu.observers.append(self)
+
+    def log_registers(self, cpu):
+        """Log which registers the previous instruction changed."""
+        reg = cpu.reg
+
+        if reg != self.last_reg:
+            mask = 0
+            for i in range(8):
+                if reg[i] != self.last_reg[i]:
+                    mask |= 1 << i
+
+            self.reg_steps.append(self.position - 1)
+            self.reg_masks.append(mask)
+            self.last_reg = list(reg)
+
+    def step(self, cpu, ir, op_a, op_b):
+        """Called by CPU.run() before each instruction."""
+        step = self.position
+        self.log_registers(cpu)
+
+        if step % self.interval == 0:
+            countdown = (self.start_countdown - 1 - step) % \
+                cpu.poll_interval + 1
+            self.snapshot_steps.append(step)
+            self.snapshots.append(save_state(
+                cpu, self.start_instructions + step, countdown))
+            self.trim()
+
+        self.position = step + 1
+
+    def memory_used(self):
+        deltas = len(self.write_steps) + len(self.reg_steps)
+        return len(self.snapshots) * self.snapshot_size + \
+            deltas * DELTA_BYTES
+
+    def trim(self):
+        """Forget the oldest history until we're inside the budget."""
+        while len(self.snapshots) > 1 and self.memory_used() > self.budget:
+            del self.snapshots[0]
+            del self.snapshot_steps[0]
+            oldest = self.snapshot_steps[0]
+
+            i = bisect_left(self.write_steps, oldest)
+            del self.write_steps[:i]
+            del self.write_addrs[:i]
+
+            i = bisect_left(self.reg_steps, oldest)
+            del self.reg_steps[:i]
+            del self.reg_masks[:i]
+
+    def truncate(self, step):
+        """Forget history after `step`, it's about to be re-made."""
+        i = bisect_right(self.snapshot_steps, step)
+        del self.snapshots[i:]
+        del self.snapshot_steps[i:]
+
+        i = bisect_left(self.write_steps, step)
+        del self.write_steps[i:]
+        del self.write_addrs[i:]
+
+        i = bisect_left(self.reg_steps, step)
+        del self.reg_steps[i:]
+        del self.reg_masks[i:]
+
+    def oldest(self):
+        """Earliest step we can still go back to."""
+        return self.snapshot_steps[0] if self.snapshots else self.position
+
+    def goto(self, target):
+        """
+        Put the CPU in the state it was in just before instruction number
+        `target` executed.
+        """
+        cpu = self.cpu
+
+        if not self.oldest() <= target:
+            raise ValueError(f"step {target} is no longer in the history "
+                             f"(oldest is {self.oldest()})")
+
+        i = bisect_right(self.snapshot_steps, target) - 1
+        restore_state(cpu, self.snapshots[i])
+
+        observers, devices = cpu.observers, cpu.devices
+        cpu.observers = []
+        cpu.devices = QuietDevices()
+        self.recording = False
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                cpu.run(target - self.snapshot_steps[i])
+        finally:
+            cpu.observers, cpu.devices = observers, devices
+            self.recording = True
+
+        # whatever happens next is a new future
+        self.truncate(target)
+        self.position = target
+        self.last_reg = list(cpu.reg)
+        cpu.running = True
+
+    def reverse_step(self, n=1):
+        self.goto(max(self.oldest(), self.position - n))
+
+    def last_write(self, addresses, before=None):
+        """Step number of the last write to any of `addresses`, or None."""
+        if before is None:
+            before = self.position
+
+        i = bisect_left(self.write_steps, before) - 1
+
+        while i >= 0:
+            if self.write_addrs[i] in addresses:
+                return self.write_steps[i]
+            i -= 1
+
+        return None
+
+    def last_register_change(self, registers, before=None):
+        """
+        Step number of the last change to any of `registers`, or None.
+        """
+        if before is None:
+            before = self.position
+
+        # the instruction we stopped after hasn't been logged yet
+        self.log_registers(self.cpu)
+
+        mask = 0
+        for r in registers:
+            mask |= 1 << r
+
+        i = bisect_left(self.reg_steps, before) - 1
+
+        while i >= 0:
+            if self.reg_masks[i] & mask:
+                return self.reg_steps[i]
+            i -= 1
+
+        return None
+
+    def reverse_continue(self, watchpoints, registers=()):
+        """
+        Go back to just before the last instruction that wrote a watched
+        address or changed a watched register. Returns its step number, or
+        None if there's none in the history (the CPU is left where it was).
+        """
+        steps = [step for step in (self.last_write(watchpoints),
+                                   self.last_register_change(registers))
+                 if step is not None]
+        step = max(steps) if steps else None
+
+        if step is not None:
+            self.goto(step)
+
+        return step
+
+    def forward(self, n=1):
+        """Execute n more instructions, recording as we go."""
+        self.cpu.running = True
+        self.cpu.run(n)
+
+
+def print_state(cpu, tt, f=sys.stdout):
+    regs = " ".join("%02X" % (r & 0xFF) for r in cpu.reg)
+    ir = cpu.ram[cpu.pc] if cpu.pc < len(cpu.ram) else 0
+    print(f"step {tt.position} (history from {tt.oldest()}): PC {cpu.pc:02X} "
+          f"IR {ir:02X} SP {cpu.sp:02X} FL {cpu.flag:02X} | {regs} | "
+          f"{cpu.where()}", file=f)
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(f"usage: {argv[0]} program.ls8", file=sys.stderr)
+        return 1
+
+    cpu = CPU()
+    tt = TimeTravel()
+    tt.attach(cpu)
+    cpu.load(argv[1])
+
+    try:
+        cpu.run()
+        print("halted")
+    except Exception as e:
+        print(f"crashed at {cpu.where()}: {e!r}")
+        # step back to just before the crashing instruction
+        tt.goto(tt.position - 1)
+    except KeyboardInterrupt:
+        print("interrupted")
+
+    watchpoints = set()
+    register_watchpoints = set()
+    print_state(cpu, tt)
+
+    while True:
+        try:
+            line = input("tt> ").split()
+        except EOFError:
+            break
+
+        if not line:
+            continue
+
+        command, args = line[0], line[1:]
+
+        try:
+            if command == "q":
+                break
+            elif command == "rs":
+                tt.reverse_step(int(args[0]) if args else 1)
+            elif command == "s":
+                tt.forward(int(args[0]) if args else 1)
+            elif command == "w":
+                watchpoints.add(int(args[0], 16))
+                continue
+            elif command == "wr":
+                register_watchpoints.add(int(args[0]))
+                continue
+            elif command == "rc":
+                if tt.reverse_continue(watchpoints,
+                                       register_watchpoints) is None:
+                    print("no earlier write to a watched address or "
+                          "register")
+            elif command == "lw":
+                if tt.reverse_continue({int(args[0], 16)}) is None:
+                    print("no earlier write to that address")
+            elif command == "lr":
+                if tt.reverse_continue((), {int(args[0])}) is None:
+                    print("no earlier change to that register")
+            elif command != "p":
+                print("unknown command")
+                continue
+        except Exception as e:
+            print(f"error: {e!r}")
+
+        print_state(cpu, tt)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
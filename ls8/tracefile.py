@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+"""Compressed binary instruction traces.
+
+Every executed instruction becomes one record holding the machine state
+just before it ran:
+
+    pc, ir, op_a, op_b, flag, sp, changed, then the changed registers
+
+`changed` has bit n set if register n differs from the previous record, and
+only those registers' values follow, lowest first. The 7-byte prefix is
+fixed but the registers aren't, so a record is 7 to 15 bytes. The first
+record of each chunk has every bit set. Registers are
+stored as 8-bit values, as the spec defines them. Programs are traced
+without the timer or keyboard, so verify can re-run them exactly.
+
+Records are buffered into chunks, and each chunk is compressed on its own
+(zlib or lzma), so a reader only ever has one chunk in memory. A chunk
+index at the end of the file lets readers seek straight to the chunk
+holding a record, but no further: records have no fixed size, so a chunk
+is always decoded from its first record.
+
+File layout:
+
+    header  "LS8T" version codec record prefix size
+    chunk   u32 compressed length, u32 record count, data  (repeated)
+    index   u64 file offset, u64 first record  (one per chunk)
+    footer  u32 chunk count, u64 index offset, "LS8T"
+
+Usage:
+
+    python3 tracefile.py record program.ls8 out.trace [zlib|lzma]
+    python3 tracefile.py dump out.trace [first record]
+    python3 tracefile.py verify program.ls8 out.trace
+"""
+
+import lzma
+import struct
+import sys
+import zlib
+from collections import namedtuple
+
+from cpu import CPU
+from devices import QuietDevices
+
+MAGIC = b"LS8T"
+VERSION = 2
+
+HEADER = struct.Struct("<4sBBB")
+CHUNK_HEADER = struct.Struct("<II")
+INDEX_ENTRY = struct.Struct("<QQ")
+FOOTER = struct.Struct("<IQ4s")
+RECORD_PREFIX = struct.Struct("<7B")  # followed by the changed registers
+
+CHUNK_RECORDS = 4096  # records per compressed chunk
+
+CODECS = {
+    "zlib": (0, zlib.compress, zlib.decompress),
+    "lzma": (1, lzma.compress, lzma.decompress),
+}
+DECOMPRESS = {code: decompress for code, _, decompress in CODECS.values()}
+
+# changed mask -> the registers whose values follow, lowest first
+CHANGED_REGISTERS = [[r for r in range(8) if mask >> r & 1]
+                     for mask in range(256)]
+
+Record = namedtuple("Record",
+                    ["pc", "ir", "op_a", "op_b", "flag", "sp", "changed",
+                     "reg"])
+
+
+class TraceError(Exception):
+    pass
+
+
+class TraceRecorder:
+    """CPU observer that writes a binary trace file."""
+
+    def __init__(self, filename, codec="zlib"):
+        code, self.compress, _ = CODECS[codec]
+
+        self.f = open(filename, "wb")
+        self.f.write(HEADER.pack(MAGIC, VERSION, code, RECORD_PREFIX.size))
+
+        self.buffer = bytearray()
+        self.buffered = 0  # records in the buffer
+        self.count = 0  # records written out in earlier chunks
+        self.index = []
+        self.last_reg = [None] * 8  # every register counts as changed
+
+    def attach(self, cpu):
+        cpu.observers.append(self)
+
+    def step(self, cpu, ir, op_a, op_b):
+        """Called by CPU.run() before each instruction."""
+        reg = [r & 0xFF for r in cpu.reg]
+
+        changed = 0
+        values = []
+        for i in range(8):
+            if reg[i] != self.last_reg[i]:
+                changed |= 1 << i
+                values.append(reg[i])
+        self.last_reg = reg
+
+        self.buffer += RECORD_PREFIX.pack(cpu.pc, ir, op_a, op_b, cpu.flag & 0xFF,
+                                   cpu.sp & 0xFF, changed)
+        self.buffer += bytes(values)
+        self.buffered += 1
+
+        if self.buffered == CHUNK_RECORDS:
+            self.flush()
+
+    def flush(self):
+        """Compress and write out the buffered records."""
+        if self.buffered == 0:
+            return
+
+        data = self.compress(bytes(self.buffer))
+
+        self.index.append((self.f.tell(), self.count))
+        self.f.write(CHUNK_HEADER.pack(len(data), self.buffered))
+        self.f.write(data)
+
+        self.count += self.buffered
+        self.buffered = 0
+        self.buffer = bytearray()
+        # chunks are read on their own, so each starts with all registers
+        self.last_reg = [None] * 8
+
+    def close(self):
+        self.flush()
+
+        index_offset = self.f.tell()
+        for offset, first in self.index:
+            self.f.write(INDEX_ENTRY.pack(offset, first))
+        self.f.write(FOOTER.pack(len(self.index), index_offset, MAGIC))
+
+        self.f.close()
+
+
+class TraceReader:
+    """Streams records out of a trace file, one chunk at a time."""
+
+    def __init__(self, filename):
+        self.f = open(filename, "rb")
+
+        magic, version, code, prefix_size = \
+            HEADER.unpack(self.f.read(HEADER.size))
+
+        if magic != MAGIC or version != VERSION or \
+                prefix_size != RECORD_PREFIX.size:
+            raise TraceError(f"{filename}: not an LS-8 trace file")
+
+        self.decompress = DECOMPRESS[code]
+
+        self.f.seek(-FOOTER.size, 2)
+        chunks, index_offset, magic = FOOTER.unpack(self.f.read(FOOTER.size))
+
+        if magic != MAGIC:
+            raise TraceError(f"{filename}: truncated trace file")
+
+        self.f.seek(index_offset)
+        self.index = [INDEX_ENTRY.unpack(self.f.read(INDEX_ENTRY.size))
+                      for _ in range(chunks)]
+
+    def __len__(self):
+        if not self.index:
+            return 0
+
+        offset, first = self.index[-1]
+        self.f.seek(offset)
+        _, count = CHUNK_HEADER.unpack(self.f.read(CHUNK_HEADER.size))
+
+        return first + count
+
+    def records(self, start=0):
+        """Yield Records from record number `start` to the end."""
+        for offset, first in self.index:
+            self.f.seek(offset)
+            length, count = CHUNK_HEADER.unpack(
+                self.f.read(CHUNK_HEADER.size))
+
+            # skip whole chunks before the start without decompressing
+            if first + count <= start:
+                continue
+
+            data = self.decompress(self.f.read(length))
+            pos = 0
+            reg = [0] * 8
+
+            # records have no fixed size, so decode from the chunk's start
+            for i in range(count):
+                fields = RECORD_PREFIX.unpack_from(data, pos)
+                pos += RECORD_PREFIX.size
+                for r in CHANGED_REGISTERS[fields[6]]:
+                    reg[r] = data[pos]
+                    pos += 1
+
+                if first + i >= start:
+                    yield Record(*fields, tuple(reg))
+
+    def close(self):
+        self.f.close()
+
+
+class TraceChecker:
+    """
+    CPU observer that checks each instruction against a recorded trace,
+    raising TraceError at the first difference.
+    """
+
+    def __init__(self, reader):
+        self.records = reader.records()
+        self.count = 0
+
+    def attach(self, cpu):
+        cpu.observers.append(self)
+
+    def step(self, cpu, ir, op_a, op_b):
+        record = next(self.records, None)
+
+        if record is None:
+            raise TraceError(f"record {self.count}: trace ended but the "
+                             f"CPU is still running at PC {cpu.pc:02X}")
+
+        reg = tuple(r & 0xFF for r in cpu.reg)
+        state = (cpu.pc, ir, op_a, op_b, cpu.flag & 0xFF, cpu.sp & 0xFF, reg)
+        expected = (record.pc, record.ir, record.op_a, record.op_b,
+                    record.flag, record.sp, record.reg)
+
+        if state != expected:
+            raise TraceError(f"record {self.count}: expected {expected}, "
+                             f"got {state}")
+
+        self.count += 1
+
+    def finish(self):
+        """Make sure the whole trace was replayed."""
+        if next(self.records, None) is not None:
+            raise TraceError(f"CPU halted after {self.count} records but "
+                             f"the trace has more")
+
+
+def record(program, filename, codec="zlib"):
+    recorder = TraceRecorder(filename, codec)
+
+    cpu = CPU()
+    # verify() re-runs the program, so no timer or keyboard
+    cpu.devices = QuietDevices()
+    recorder.attach(cpu)
+    cpu.load(program)
+
+    try:
+        cpu.run()
+    finally:
+        recorder.close()
+
+    return recorder.count
+
+
+def verify(program, filename):
+    """Re-run a program and check it matches its trace. Returns the count."""
+    reader = TraceReader(filename)
+    checker = TraceChecker(reader)
+
+    cpu = CPU()
+    cpu.devices = QuietDevices()
+    checker.attach(cpu)
+    cpu.load(program)
+
+    try:
+        cpu.run()
+        checker.finish()
+    finally:
+        reader.close()
+
+    return checker.count
+
+
+def dump(filename, start=0, f=sys.stdout):
+    reader = TraceReader(filename)
+
+    for n, r in enumerate(reader.records(start), start):
+        regs = " ".join("%02X" % v for v in r.reg)
+        f.write(f"{n:>8} {r.pc:02X} | {r.ir:02X} {r.op_a:02X} {r.op_b:02X} | "
+                f"FL {r.flag:02X} SP {r.sp:02X} | {regs}\n")
+
+    reader.close()
+
+
+def main(argv):
+    if len(argv) >= 4 and argv[1] == "record":
+        codec = argv[4] if len(argv) > 4 else "zlib"
+        count = record(argv[2], argv[3], codec)
+        print(f"{count} records", file=sys.stderr)
+
+    elif len(argv) >= 3 and argv[1] == "dump":
+        dump(argv[2], int(argv[3]) if len(argv) > 3 else 0)
+
+    elif len(argv) >= 4 and argv[1] == "verify":
+        try:
+            count = verify(argv[2], argv[3])
+        except TraceError as e:
+            print(f"trace mismatch: {e}", file=sys.stderr)
+            return 2
+
+        print(f"{count} records match", file=sys.stderr)
+
+    else:
+        print(f"usage: {argv[0]} record program.ls8 out.trace [zlib|lzma]\n"
+              f"       {argv[0]} dump out.trace [first record]\n"
+              f"       {argv[0]} verify program.ls8 out.trace",
+              file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))